@@ -3,7 +3,20 @@
 csv.py - read/write/investigate CSV files
 """
 
+import codecs
+import copy
+import hashlib
+import json
+import mmap
+import os
 import re
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter, OrderedDict, deque, namedtuple
+from itertools import chain, islice
+from functools import partial, wraps
+from operator import eq, itemgetter
 from _csv import Error, __version__, writer, reader, register_dialect, \
                  unregister_dialect, get_dialect, list_dialects, \
                  field_size_limit, \
@@ -18,7 +31,8 @@ __all__ = ["QUOTE_MINIMAL", "QUOTE_ALL", "QUOTE_NONNUMERIC", "QUOTE_NONE",
            "field_size_limit", "reader", "writer",
            "register_dialect", "get_dialect", "list_dialects", "Sniffer",
            "unregister_dialect", "__version__", "DictReader", "DictWriter",
-           "unix_dialect"]
+           "unix_dialect", "sniff_many", "DialectCache", "parallel_reader",
+           "AsyncDictReader", "AsyncDictWriter", "SniffProfile"]
 
 class Dialect:
     """Describe a CSV dialect.
@@ -78,12 +92,34 @@ class unix_dialect(Dialect):
 register_dialect("unix", unix_dialect)
 
 
+def _tuple_getter(keys):
+    # like itemgetter(*keys), but always returning a tuple; keys may be
+    # any collection, such as dict.keys()
+    keys = tuple(keys)
+    if len(keys) == 1:
+        get = itemgetter(keys[0])
+        return lambda obj: (get(obj),)
+    if keys:
+        return itemgetter(*keys)
+    return lambda obj: ()
+
+
 class DictReader:
     def __init__(self, f, fieldnames=None, restkey=None, restval=None,
-                 dialect="excel", *args, **kwds):
+                 dialect="excel", *args, record="dict", usecols=None,
+                 where=None, **kwds):
+        if record not in ("dict", "namedtuple"):
+            raise ValueError("record (%s) must be 'dict' or 'namedtuple'"
+                             % record)
         self._fieldnames = fieldnames   # list of keys for the dict
         self.restkey = restkey          # key to catch long rows
         self.restval = restval          # default value for short rows
+        self.record = record            # type of the rows returned
+        self._record_class = None       # namedtuple built from fieldnames
+        self.usecols = usecols          # names or indexes of the fields kept
+        self._selection = None          # usecols resolved against fieldnames
+        self.where = where              # field -> predicate rows must pass
+        self._accept = None             # where compiled against fieldnames
         self.reader = reader(f, dialect, *args, **kwds)
         self.dialect = dialect
         self.line_num = 0
@@ -104,6 +140,77 @@ class DictReader:
     @fieldnames.setter
     def fieldnames(self, value):
         self._fieldnames = value
+        self._record_class = None
+        self._selection = None
+        self._accept = None
+
+    def _indexes(self, columns, argname):
+        # positions in fieldnames of the given names or indexes
+        fieldnames = self._fieldnames
+        positions = {}
+        for i, name in enumerate(fieldnames):
+            positions.setdefault(name, i)
+        indexes = []
+        wrong_fields = []
+        for col in columns:
+            if isinstance(col, int):
+                if 0 <= col < len(fieldnames):
+                    indexes.append(col)
+                    continue
+            elif col in positions:
+                indexes.append(positions[col])
+                continue
+            wrong_fields.append(col)
+        if wrong_fields:
+            raise ValueError("%s contains fields not in fieldnames: " % argname
+                             + ", ".join([repr(x) for x in wrong_fields]))
+        return indexes
+
+    def _select(self):
+        # (names, indexes, getter) of the fields in usecols, resolved once
+        # per header
+        indexes = self._indexes(self.usecols, "usecols")
+        names = [self._fieldnames[i] for i in indexes]
+        self._selection = names, indexes, _tuple_getter(indexes)
+        return self._selection
+
+    def _compile_where(self):
+        # One test over the raw row list, so rejected rows never become a
+        # dict.  A predicate is called with the field's string (restval
+        # for short rows); any other value is compared with ==.
+        where = self.where
+        tests = []
+        for index, test in zip(self._indexes(where, "where"), where.values()):
+            if not callable(test):
+                test = partial(eq, test)
+            tests.append((index, test))
+        restval = self.restval
+        if len(tests) == 1:
+            [(index, test)] = tests
+            def accept(row):
+                return test(row[index] if index < len(row) else restval)
+        else:
+            def accept(row):
+                lr = len(row)
+                for index, test in tests:
+                    if not test(row[index] if index < lr else restval):
+                        return False
+                return True
+        self._accept = accept
+        return accept
+
+    def _make_record_class(self):
+        # Built once per header.  Field names that aren't identifiers are
+        # renamed to _0, _1, ...; with a restkey, a last field holds the
+        # values of long rows (None for other rows).
+        if self.usecols is not None:
+            names = list((self._selection or self._select())[0])
+        else:
+            names = list(self._fieldnames)
+        if self.restkey is not None:
+            names.append(self.restkey)
+        self._record_class = namedtuple("Row", names, rename=True)
+        return self._record_class
 
     def __next__(self):
         if self.line_num == 0:
@@ -117,27 +224,201 @@ class DictReader:
         # values
         while row == []:
             row = next(self.reader)
-        d = dict(zip(self.fieldnames, row))
-        lf = len(self.fieldnames)
+        if self.where is not None:
+            accept = self._accept or self._compile_where()
+            while not (row and accept(row)):
+                row = next(self.reader)
+        self.line_num = self.reader.line_num
+        fieldnames = self._fieldnames
+        lf = len(fieldnames)
         lr = len(row)
+        if self.usecols is not None:
+            return self._project(row, lf, lr)
+        if self.record == "namedtuple":
+            return self._to_record(row, lf, lr)
+        d = dict(zip(fieldnames, row))
         if lf < lr:
             d[self.restkey] = row[lf:]
         elif lf > lr:
-            for key in self.fieldnames[lr:]:
+            for key in fieldnames[lr:]:
                 d[key] = self.restval
         return d
 
+    def _project(self, row, lf, lr):
+        # the row cut down to usecols; short rows are padded with restval
+        # and long ones keep their extra values under restkey
+        names, indexes, getvalues = self._selection or self._select()
+        if lr >= lf:
+            values = getvalues(row)
+        else:
+            restval = self.restval
+            values = tuple([row[i] if i < lr else restval for i in indexes])
+        extra = row[lf:] if lf < lr else None
+        if self.record == "namedtuple":
+            if self.restkey is not None:
+                values += (extra,)
+            elif extra is not None:
+                self._long_row()
+            return (self._record_class or self._make_record_class())(*values)
+        d = dict(zip(names, values))
+        if extra is not None:
+            d[self.restkey] = extra
+        return d
+
+    def read_batch(self, n, typed=False, numpy=False):
+        """Read up to n rows and return them column by column.
+
+        The result maps each fieldname (or those in usecols) to the list
+        of its values, padded with restval for short rows; if some rows
+        are long, restkey maps to their extra values (None for the other
+        rows).  Rows failing where are skipped.  It is empty once the
+        input is exhausted.
+
+        With typed, a column whose first cells are all ints (or ints and
+        floats), judged as Sniffer.has_header() does, is returned as an
+        array.array of 'q' (or 'd') if every cell converts.  With numpy
+        (which must be importable), the fieldname columns are NumPy
+        arrays instead, of dtype object when not numeric.
+        """
+        rows = self._read_rows(n)
+        if not rows:
+            return {}
+        lf = len(self._fieldnames)
+        if self.usecols is not None:
+            names, indexes, _ = self._selection or self._select()
+            batch = {name: list(map(itemgetter(i), rows))
+                     for name, i in zip(names, indexes)}
+            if len(rows[0]) > lf:
+                batch[self.restkey] = list(map(itemgetter(lf), rows))
+        else:
+            names = self._fieldnames
+            keys = list(names)
+            if len(rows[0]) > lf:
+                keys.append(self.restkey)
+            batch = dict(zip(keys, map(list, zip(*rows))))
+
+        if typed or numpy:
+            for name in names:
+                batch[name] = _typed_column(batch[name])
+        if numpy:
+            import numpy
+            for name in names:
+                column = batch[name]
+                if isinstance(column, list):
+                    batch[name] = numpy.array(column, dtype=object)
+                else:
+                    batch[name] = numpy.frombuffer(column,
+                                                   dtype=column.typecode)
+        return batch
+
+    def iter_batches(self, n, typed=False, numpy=False):
+        """Iterate over the rest of the input with read_batch(n)."""
+        while True:
+            batch = self.read_batch(n, typed, numpy)
+            if not batch:
+                return
+            yield batch
+
+    def _read_rows(self, n):
+        # Up to n non-blank rows, all made as long as the field names (plus
+        # one slot holding the extra values, if any row is long).
+        if self.line_num == 0:
+            # Used only for its side effect.
+            self.fieldnames
+        if self._fieldnames is None:
+            return []
+        lf = len(self._fieldnames)
+        rows = []
+        long_rows = False
+        source = filter(None, self.reader)
+        if self.where is not None:
+            source = filter(self._accept or self._compile_where(), source)
+        for row in islice(source, n):
+            lr = len(row)
+            if lf < lr:
+                row[lf:] = [row[lf:]]
+                long_rows = True
+            elif lf > lr:
+                row.extend([self.restval] * (lf - lr))
+            rows.append(row)
+        self.line_num = self.reader.line_num
+        if long_rows:
+            for row in rows:
+                if len(row) == lf:
+                    row.append(None)
+        return rows
+
+    def _long_row(self):
+        # a record has no None field to keep extra values under, as a
+        # dict does, and dropping them would lose data unnoticed
+        raise Error("line %d has more fields than fieldnames; set restkey "
+                    "to keep them in records" % self.line_num)
+
+    def _to_record(self, row, lf, lr):
+        make = (self._record_class or self._make_record_class())._make
+        if self.restkey is None:
+            if lf == lr:
+                return make(row)
+            if lf < lr:
+                self._long_row()
+            return make(row + [self.restval] * (lf - lr))
+        if lf == lr:
+            row.append(None)
+        elif lf < lr:
+            row[lf:] = [row[lf:]]
+        else:
+            row.extend([self.restval] * (lf - lr))
+            row.append(None)
+        return make(row)
+
+
+def _typed_column(column):
+    # array.array of the column's numbers, or the column itself when its
+    # cells aren't all ints or floats; cells that aren't strings (such as
+    # a restval of None padding short rows) are not numbers
+    types = {_cell_type(cell) if isinstance(cell, str) else None
+             for cell in column[:21]}
+    try:
+        if types == {int}:
+            return array('q', map(int, column))
+        if types == {float} or types == {int, float}:
+            return array('d', map(float, column))
+    except (ValueError, OverflowError, TypeError):
+        pass
+    return column
+
 
 class DictWriter:
     def __init__(self, f, fieldnames, restval="", extrasaction="raise",
-                 dialect="excel", *args, **kwds):
+                 dialect="excel", *args, buffer_size=None, **kwds):
         self.fieldnames = fieldnames    # list of keys for the dict
         self.restval = restval          # for writing short dicts
         if extrasaction.lower() not in ("raise", "ignore"):
             raise ValueError("extrasaction (%s) must be 'raise' or 'ignore'"
                              % extrasaction)
         self.extrasaction = extrasaction
-        self.writer = writer(f, dialect, *args, **kwds)
+        self.buffer_size = buffer_size  # characters to buffer before writing
+        if buffer_size is None:
+            self.writer = writer(f, dialect, *args, **kwds)
+        else:
+            # rows are formatted into _buffer and written to f in blocks;
+            # the last block is only written by flush() or close(), which
+            # leaving a with block calls
+            self._target = f
+            self._buffer = StringIO(newline='')
+            self.writer = writer(self._buffer, dialect, *args, **kwds)
+            self._plain = _plain_format(self.writer.dialect)
+
+    @property
+    def fieldnames(self):
+        return self._fieldnames
+
+    @fieldnames.setter
+    def fieldnames(self, value):
+        # the lookups done for every row are prepared once per header
+        self._fieldnames = value
+        self._fieldset = frozenset(value)
+        self._getvalues = _tuple_getter(value)
 
     def writeheader(self):
         header = dict(zip(self.fieldnames, self.fieldnames))
@@ -145,32 +426,548 @@ class DictWriter:
 
     def _dict_to_list(self, rowdict):
         if self.extrasaction == "raise":
-            wrong_fields = [k for k in rowdict if k not in self.fieldnames]
-            if wrong_fields:
+            if not self._fieldset.issuperset(rowdict):
+                wrong_fields = [k for k in rowdict
+                                if k not in self._fieldset]
                 raise ValueError("dict contains fields not in fieldnames: "
                                  + ", ".join([repr(x) for x in wrong_fields]))
+        # Dict subclasses may define __missing__, which must not be used
+        # in place of restval.
+        if type(rowdict) is dict:
+            try:
+                return self._getvalues(rowdict)
+            except KeyError:
+                pass
         return (rowdict.get(key, self.restval) for key in self.fieldnames)
 
     def writerow(self, rowdict):
+        if self.buffer_size is not None:
+            return self._write_buffered(self._dict_to_list(rowdict))
         return self.writer.writerow(self._dict_to_list(rowdict))
 
     def writerows(self, rowdicts):
+        if self.buffer_size is not None:
+            for rowdict in rowdicts:
+                self._write_buffered(self._dict_to_list(rowdict))
+            return
         return self.writer.writerows(map(self._dict_to_list, rowdicts))
 
+    def writerows_fast(self, rows):
+        """Write sequences whose values are already in fieldnames order."""
+        if self.buffer_size is not None:
+            for row in rows:
+                self._write_buffered(row)
+            return
+        return self.writer.writerows(rows)
+
+    def _write_buffered(self, values):
+        line = None
+        if self._plain is not None and type(values) is tuple:
+            delimiter, lineterminator, special = self._plain
+            try:
+                line = delimiter.join(values)
+            except TypeError:
+                pass    # not all strings; leave them to the writer
+        # a single empty field is written as "" so it isn't a blank line
+        if (line and line.count(delimiter) == len(values) - 1 and
+                not special(line)):
+            written = self._buffer.write(line + lineterminator)
+        else:
+            written = self.writer.writerow(values)
+        if self._buffer.tell() >= self.buffer_size:
+            self.flush()
+        return written
+
+    def flush(self):
+        """Write the buffered rows to the file (if buffer_size is set)."""
+        if self.buffer_size is not None and self._buffer.tell():
+            self._target.write(self._buffer.getvalue())
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
+    def close(self):
+        """Write the buffered rows to the file, which is left open."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _plain_format(dialect):
+    # For QUOTE_MINIMAL dialects, (delimiter, lineterminator, search) where
+    # search finds the characters other than the delimiter that make the
+    # writer quote or escape a field; rows without any can simply be
+    # joined.  None when the dialect needs the writer's full checks.
+    if dialect.quoting != QUOTE_MINIMAL or dialect.skipinitialspace:
+        return None
+    special = set(dialect.lineterminator) | {'\r', '\n'}
+    for char in (dialect.quotechar, dialect.escapechar):
+        if char is not None:
+            special.add(char)
+    special.discard(dialect.delimiter)
+    search = re.compile('[%s]' % re.escape(''.join(sorted(special)))).search
+    return dialect.delimiter, dialect.lineterminator, search
+
+class _NeedMoreData(Exception):
+    pass
+
+class _LineFeed:
+    # Iterator over the lines read so far.  Running dry before the end of
+    # the stream raises _NeedMoreData, which reader() passes through, and
+    # the lines taken since the last row can be put back to parse the row
+    # again once more has been read.
+    def __init__(self):
+        self.lines = deque()
+        self.taken = []
+        self.eof = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.lines:
+            line = self.lines.popleft()
+            self.taken.append(line)
+            return line
+        if self.eof:
+            raise StopIteration
+        raise _NeedMoreData
+
+    def retry(self):
+        self.lines.extendleft(reversed(self.taken))
+        self.taken.clear()
+
+
+class AsyncDictReader:
+    """DictReader for asyncio streams, to be used with "async for".
+
+    stream is an asyncio.StreamReader or any object with a read(n)
+    coroutine returning bytes (decoded with encoding) or str.  It is read
+    block_size at a time, only as rows are asked for, so parsing overlaps
+    with the rest of the stream arriving.  The other arguments are those
+    of DictReader; fieldnames is known once the first row has been read.
+    """
+
+    def __init__(self, stream, fieldnames=None, restkey=None, restval=None,
+                 dialect="excel", *args, encoding='utf-8',
+                 block_size=1 << 16, **kwds):
+        self.stream = stream
+        self.block_size = block_size
+        self.line_num = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._tail = ''
+        self._feed = _LineFeed()
+        self._rows = DictReader(self._feed, fieldnames, restkey, restval,
+                                dialect, *args, **kwds)
+
+    @property
+    def fieldnames(self):
+        return self._rows._fieldnames
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._rows._fieldnames is None:
+            # the header is a row of its own; don't parse it twice
+            await self._parse(lambda: self._rows.fieldnames)
+        return await self._parse(self._rows.__next__)
+
+    async def _parse(self, step):
+        while True:
+            try:
+                result = step()
+            except _NeedMoreData:
+                self._feed.retry()
+                await self._fill()
+                continue
+            except StopIteration:
+                # can't leave a coroutine as such
+                raise StopAsyncIteration
+            self.line_num += len(self._feed.taken)
+            self._feed.taken.clear()
+            return result
+
+    async def _fill(self):
+        data = await self.stream.read(self.block_size)
+        if not data:
+            text = self._tail + self._decoder.decode(b'', True)
+            self._tail = ''
+            self._feed.lines.extend(StringIO(text, newline=''))
+            self._feed.eof = True
+            return
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        # keep the last, unfinished line for later
+        text = self._tail + data
+        cut = text.rfind('\n') + 1
+        self._tail = text[cut:]
+        self._feed.lines.extend(StringIO(text[:cut], newline=''))
+
+
+class _Blocks(list):
+    # collects the blocks a buffered DictWriter flushes
+    write = list.append
+
+
+class AsyncDictWriter:
+    """DictWriter for asyncio streams.
+
+    Rows are formatted into blocks of about buffer_size characters.  A
+    stream with a drain() coroutine, such as asyncio.StreamWriter, is sent
+    each block encoded with encoding and then drained, so a slow peer
+    holds the writer back; any other stream is sent str and its write()
+    awaited if it is a coroutine.  flush() sends what is left.  The other
+    arguments are those of DictWriter.
+    """
+
+    def __init__(self, stream, fieldnames, restval="", extrasaction="raise",
+                 dialect="excel", *args, encoding='utf-8',
+                 buffer_size=1 << 16, **kwds):
+        self.stream = stream
+        self.encoding = encoding
+        self._blocks = _Blocks()
+        self._writer = DictWriter(self._blocks, fieldnames, restval,
+                                  extrasaction, dialect, *args,
+                                  buffer_size=buffer_size, **kwds)
+
+    @property
+    def fieldnames(self):
+        return self._writer.fieldnames
+
+    async def writeheader(self):
+        self._writer.writeheader()
+        await self._send()
+
+    async def writerow(self, rowdict):
+        written = self._writer.writerow(rowdict)
+        await self._send()
+        return written
+
+    async def writerows(self, rowdicts):
+        # rowdicts may also be an async iterable
+        if hasattr(rowdicts, '__aiter__'):
+            async for rowdict in rowdicts:
+                await self.writerow(rowdict)
+        else:
+            for rowdict in rowdicts:
+                await self.writerow(rowdict)
+
+    async def flush(self):
+        self._writer.flush()
+        await self._send()
+
+    async def _send(self):
+        while self._blocks:
+            block = self._blocks.pop(0)
+            drain = getattr(self.stream, 'drain', None)
+            if drain is not None:
+                self.stream.write(block.encode(self.encoding))
+                await drain()
+            else:
+                result = self.stream.write(block)
+                if hasattr(result, '__await__'):
+                    await result
+
+
 # Guard Sniffer's type checking against builds that exclude complex()
 try:
     complex
 except NameError:
     complex = float
 
+# Fast paths for the types has_header() tries.  Cells matching neither
+# are only handed to int(), float() and complex() if they are made of
+# characters a number can contain.
+_int_match = re.compile(r'[ \t]*[+-]?[0-9]+[ \t]*\Z').match
+_float_match = re.compile(r'[ \t]*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)'
+                          r'(?:[eE][+-]?[0-9]+)?[ \t]*\Z').match
+_not_number = re.compile(r'[^\d\s+\-._()eEjJiInNfFtTyYaA]').search
+
+# placeholder for a column type that has not been seen yet
+_unknown = object()
+
+def _cell_type(cell):
+    """Return int, float or complex if cell parses as one, else None."""
+    if _int_match(cell):
+        return int
+    if _float_match(cell):
+        return float
+    if _not_number(cell):
+        return None
+    for thisType in (int, float, complex):
+        try:
+            thisType(cell)
+            return thisType
+        except (ValueError, OverflowError):
+            pass
+    return None
+
+def _header_vote(cell, colType):
+    # +1 if cell looks like the header of a column of colType, -1 if not
+    # It's better to use `isinstance()` instead of type comparsion
+    if type(colType) == type(0): # it's a length
+        if len(cell) != colType:
+            return 1
+        return -1
+    try: # attempt typecast
+        colType(cell)
+    except (ValueError, TypeError):
+        return 1
+    return -1
+
+# Sniffer looks for text enclosed between two identical quotes, as the
+# findall() of the first of these regexps to match anything would find it
+# (delim and space being None for the last one):
+#   ,".*?",  (?P<delim>[^\w\n"'])(?P<space> ?)(?P<quote>["']).*?(?P=quote)(?P=delim)
+#   ".*?",   (?:^|\n)(?P<quote>["']).*?(?P=quote)(?P<delim>[^\w\n"'])(?P<space> ?)
+#   ,".*?"   (?P<delim>>[^\w\n"'])(?P<space> ?)(?P<quote>["']).*?(?P=quote)(?:$|\n)
+#   ".*?"    (?:^|\n)(?P<quote>["']).*?(?P=quote)(?:$|\n)
+# Running them over a sample full of unclosed quotes is quadratic, so
+# _quoted_scan() finds the same matches in one linear pass.
+
+_find_quotes = re.compile('["\']').finditer
+
+def _is_delim(char):
+    # [^\w\n"'] in the patterns above
+    return not (char.isalnum() or char in '_\n"\'')
+
+def _next_closing(positions, pos):
+    # the lazy .*? stops at the first closing quote after the opening one
+    i = bisect_right(positions, pos)
+    if i < len(positions):
+        return positions[i]
+    return None
+
+def _quoted_scan(data):
+    """Return the (quote, delim, space) triples of the regexps above.
+
+    Only the quote characters are visited: each one is filed as a
+    possible closing quote by what follows it, and the openings of every
+    pattern are then paired with their first closing quote, skipping
+    openings inside an earlier match just like findall() does.
+    """
+    quotes = [m.start() for m in _find_quotes(data)]
+    if not quotes:
+        return []
+
+    size = len(data)
+    close_delim = {}                # (quote, delim) -> positions
+    close_any = {'"': [], "'": []}  # quote followed by any delim
+    close_eol = {'"': [], "'": []}  # quote at the end of a line
+    for pos in quotes:
+        after = data[pos+1:pos+2]
+        if not after or after == '\n':
+            close_eol[data[pos]].append(pos)
+        elif _is_delim(after):
+            close_any[data[pos]].append(pos)
+            close_delim.setdefault((data[pos], after), []).append(pos)
+
+    # ,".*?",
+    matches = []
+    end = 0
+    for pos in quotes:
+        quote = data[pos]
+        openings = []
+        if pos >= 2 and data[pos-1] == ' ' and _is_delim(data[pos-2]):
+            openings.append((pos - 2, data[pos-2], ' '))
+        if pos >= 1 and _is_delim(data[pos-1]):
+            openings.append((pos - 1, data[pos-1], ''))
+        for start, delim, space in openings:
+            if start < end:
+                continue
+            closing = _next_closing(close_delim.get((quote, delim), ()), pos)
+            if closing is not None:
+                matches.append((quote, delim, space))
+                end = closing + 2
+                break
+    if matches:
+        return matches
+
+    #  ".*?",
+    end = 0
+    for pos in quotes:
+        if pos < end or (pos and data[pos-1] != '\n'):
+            continue
+        quote = data[pos]
+        closing = _next_closing(close_any[quote], pos)
+        if closing is not None:
+            space = ' ' if data[closing+2:closing+3] == ' ' else ''
+            matches.append((quote, data[closing+1], space))
+            end = closing + 2 + len(space)
+    if matches:
+        return matches
+
+    # ,".*?"
+    end = 0
+    for pos in quotes:
+        quote = data[pos]
+        openings = []
+        if (pos >= 3 and data[pos-1] == ' ' and _is_delim(data[pos-2]) and
+                data[pos-3] == '>'):
+            openings.append((pos - 3, data[pos-3:pos-1], ' '))
+        if pos >= 2 and _is_delim(data[pos-1]) and data[pos-2] == '>':
+            openings.append((pos - 2, data[pos-2:pos], ''))
+        for start, delim, space in openings:
+            if start < end:
+                continue
+            closing = _next_closing(close_eol[quote], pos)
+            if closing is not None:
+                matches.append((quote, delim, space))
+                end = closing + 1
+                break
+    if matches:
+        return matches
+
+    #  ".*?" (no delim, no space)
+    end = 0
+    for pos in quotes:
+        if pos < end or (pos and data[pos-1] != '\n'):
+            continue
+        quote = data[pos]
+        closing = _next_closing(close_eol[quote], pos)
+        if closing is not None:
+            matches.append((quote, None, None))
+            end = closing + 1
+    return matches
+
+# how much of each sampled region of a file the quote guess looks at
+_QUOTE_WINDOW = 1 << 16
+
+def _sample_regions(mm, budget, count=3):
+    # (start, end) offsets of count evenly spaced runs of whole lines,
+    # together about budget bytes long, from the head to the tail of mm;
+    # a file within budget is cut into count runs covering all of it
+    size = len(mm)
+    if size <= budget:
+        bounds = [0]
+        for i in range(1, count):
+            pos = size * i // count
+            cut = mm.find(b'\n', pos - 1) + 1 or size if pos else 0
+            bounds.append(max(cut, bounds[-1]))
+        bounds.append(size)
+        return [(start, end) for start, end in zip(bounds, bounds[1:])
+                if start < end]
+    part = budget // count
+    regions = []
+    prev = 0
+    for i in range(count):
+        start = (size - part) * i // max(count - 1, 1)
+        if start:
+            # skip to the start of the next line
+            start = mm.find(b'\n', start - 1) + 1 or size
+        start = max(start, prev)
+        end = min(start + part, size)
+        if end < size:
+            # and drop the last partial line
+            end = mm.rfind(b'\n', start, end) + 1 or end
+        if start < end:
+            regions.append((start, end))
+            prev = end
+    return regions
+
+def _quote_windows(mm, view, regions, encoding):
+    # the head of each region, cut back to whole lines, that the quote
+    # guess looks at; each ends with a newline, so no line is glued onto
+    # the first one of the next region
+    for start, end in regions:
+        if end - start > _QUOTE_WINDOW:
+            end = mm.rfind(b'\n', start, start + _QUOTE_WINDOW) + 1 or \
+                  start + _QUOTE_WINDOW
+        text = str(view[start:end], encoding, 'ignore')
+        yield text if text.endswith('\n') else text + '\n'
+
+def _region_lines(mm, view, regions, encoding):
+    # the lines of the regions, decoded one at a time
+    for start, end in regions:
+        pos = start
+        while pos < end:
+            newline = mm.find(b'\n', pos, end)
+            if newline == -1:
+                newline = end
+            yield str(view[pos:newline], encoding, 'replace')
+            pos = newline + 1
+
+class SniffProfile:
+    """
+    Timings and counters gathered by a Sniffer, to explain slow samples.
+
+    timings maps a phase ("quote_and_delimiter", "guess_delimiter",
+    "has_header") to its total seconds and calls to how often it ran;
+    phases nest, so has_header includes the sniffing it does.  lines,
+    chunks and threshold_steps count the lines scanned, the chunks
+    evaluated and the consistency levels tried by the delimiter guess,
+    and chunk_times holds the seconds spent on each chunk.  If callback
+    is given, it is called as callback(phase, seconds, profile) whenever
+    a phase finishes, e.g. to log the samples that take too long.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timings = {}
+        self.calls = {}
+        self.lines = 0
+        self.chunks = 0
+        self.threshold_steps = 0
+        self.chunk_times = []
+
+    def _record(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        if self.callback is not None:
+            self.callback(phase, seconds, self)
+
+    def _chunk(self, lines, seconds):
+        self.lines += lines
+        self.chunks += 1
+        self.chunk_times.append(seconds)
+
+    def report(self):
+        """Return the breakdown as a few lines of text."""
+        lines = ["%-20s %6d calls %10.6fs" % (phase, self.calls[phase],
+                                               seconds)
+                 for phase, seconds in self.timings.items()]
+        lines.append("%d lines in %d chunks (slowest %.6fs), "
+                     "%d threshold steps"
+                     % (self.lines, self.chunks, max(self.chunk_times,
+                                                     default=0.0),
+                        self.threshold_steps))
+        return "\n".join(lines)
+
+
+def _profiled(phase):
+    # times a Sniffer method into its profile, if it has one
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwds):
+            profile = self.profile
+            if profile is None:
+                return method(self, *args, **kwds)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwds)
+            finally:
+                profile._record(phase, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
 class Sniffer:
     '''
     "Sniffs" the format of a CSV file (i.e. delimiter, quotechar)
     Returns a Dialect object.
     '''
-    def __init__(self):
+    # a SniffProfile collecting timings, if any; also a class attribute so
+    # that subclasses not calling __init__ still work
+    profile = None
+
+    def __init__(self, profile=None):
         # in case there is more than one possible delimiter
         self.preferred = [',', '\t', ';', ' ', ':']
+        self.profile = profile
 
 
     # Too many blank line betwheen methods (should be 1)
@@ -179,12 +976,168 @@ class Sniffer:
         Returns a dialect (or None) corresponding to the sample
         """
 
+        return self._make_dialect(*self._guess(sample, delimiters))
+
+
+    def _guess(self, sample, delimiters, votes=None):
+        # votes, if given, is filled with the table of the guess that
+        # found the delimiter
+        quotechar, doublequote, delimiter, skipinitialspace = \
+                   self._guess_quote_and_delimiter(sample, delimiters, votes)
+        if not delimiter:
+            if votes is not None:
+                votes.clear()
+            delimiter, skipinitialspace = self._guess_delimiter(
+                sample, delimiters, votes=votes)
+        return quotechar, doublequote, delimiter, skipinitialspace
+
+
+    def sniff_stream(self, fileobj, delimiters=None, max_bytes=None,
+                     confidence=0.9, encoding='utf-8'):
+        """
+        Returns a (dialect, consumed) pair for the data read from fileobj
+
+        Lines are read lazily and reading stops as soon as a single
+        delimiter is consistent on at least confidence of the lines, or
+        once max_bytes have been read.  consumed is the number of bytes
+        (characters for text streams) taken from fileobj; it always ends
+        on a line boundary, so reading can carry on from there.
+        """
+
+        sample = []
+        consumed = 0
+
+        def lines():
+            nonlocal consumed
+            while max_bytes is None or consumed < max_bytes:
+                line = fileobj.readline()
+                if not line:
+                    break
+                consumed += len(line)
+                if isinstance(line, bytes):
+                    line = line.decode(encoding)
+                sample.append(line)
+                if line.endswith('\n'):
+                    line = line[:-1]
+                yield line
+
+        guessed = self._guess_delimiter(lines(), delimiters, confidence)
+
+        sample = ''.join(sample)
         quotechar, doublequote, delimiter, skipinitialspace = \
                    self._guess_quote_and_delimiter(sample, delimiters)
         if not delimiter:
-            delimiter, skipinitialspace = self._guess_delimiter(sample,
-                                                                delimiters)
+            delimiter, skipinitialspace = guessed
 
+        dialect = self._make_dialect(quotechar, doublequote, delimiter,
+                                     skipinitialspace)
+        return dialect, consumed
+
+
+    def sniff_path(self, path, delimiters=None, sample_bytes=1 << 20,
+                   encoding='utf-8'):
+        """
+        Returns a dialect for the file at path, sampled in place
+
+        The file is memory-mapped and sample_bytes of it are spread over
+        its head, middle and tail, as the format may change after a header
+        block.  The delimiter guess decodes one line at a time and the
+        quote guess only sees the whole lines in the first 64 KB of each
+        region, so memory use doesn't grow with sample_bytes.
+        """
+
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise Error("Could not determine delimiter")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                 memoryview(mm) as view:
+                regions = _sample_regions(mm, sample_bytes)
+                sample = ''.join(_quote_windows(mm, view, regions,
+                                                encoding))
+                quotechar, doublequote, delimiter, skipinitialspace = \
+                           self._guess_quote_and_delimiter(sample, delimiters)
+                if not delimiter:
+                    lines = _region_lines(mm, view, regions, encoding)
+                    delimiter, skipinitialspace = \
+                               self._guess_delimiter(lines, delimiters)
+                    lines.close()
+
+        return self._make_dialect(quotechar, doublequote, delimiter,
+                                  skipinitialspace)
+
+
+    def sniff_consensus(self, path, delimiters=None, regions=5,
+                        sample_bytes=1 << 20, workers=None,
+                        encoding='utf-8'):
+        """
+        Returns a (dialect, confidence) pair for the file at path
+
+        The file is sniffed in several regions evenly spaced from its head
+        to its tail, sharing sample_bytes between them, so a preamble or a
+        format change is outvoted instead of being trusted.  The
+        candidate delimiters each region's guess weighed (by quoted fields
+        or consistent lines) are merged into one vote table, every region
+        having one vote shared out between its candidates; the delimiter
+        with most votes wins (ties go to the preferred ones), and
+        confidence is its share of the vote.  With workers, the regions
+        are sniffed in that many processes.
+        """
+
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise Error("Could not determine delimiter")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                spans = _sample_regions(mm, sample_bytes, regions)
+
+        sniffer = self
+        if workers and self.profile is not None:
+            # regions sniffed in other processes can't report back
+            sniffer = copy.copy(self)
+            sniffer.profile = None
+        args = [(sniffer, path, start, end, delimiters, encoding)
+                for start, end in spans]
+        if workers:
+            # imported here to keep "import csv" free of multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(_sniff_region, *zip(*args)))
+        else:
+            results = [_sniff_region(*arg) for arg in args]
+
+        votes = {}
+        for guess, table in results:
+            total = sum(table.values())
+            for delim, count in table.items():
+                votes[delim] = votes.get(delim, 0) + count / total
+        if not votes:
+            raise Error("Could not determine delimiter")
+
+        def rank(delim):
+            if delim in self.preferred:
+                return votes[delim], -self.preferred.index(delim)
+            return votes[delim], -len(self.preferred)
+        delimiter = max(votes, key=rank)
+        # the other attributes as most of the regions settling on the
+        # delimiter saw them
+        guesses = [guess for guess, _ in results if guess[2] == delimiter]
+        if not guesses:
+            # it only won on split votes: ask the region giving it most
+            start, end = max(
+                zip(spans, results),
+                key=lambda item: item[1][1].get(delimiter, 0) /
+                                 (sum(item[1][1].values()) or 1))[0]
+            guesses = [_sniff_region(self, path, start, end, delimiter,
+                                     encoding)[0]]
+        quotechar, doublequote, skipinitialspace = Counter(
+            (q, dq, sp) for q, dq, _, sp in guesses).most_common(1)[0][0]
+
+        dialect = self._make_dialect(quotechar, doublequote, delimiter,
+                                     skipinitialspace)
+        return dialect, votes[delimiter] / len(results)
+
+
+    def _make_dialect(self, quotechar, doublequote, delimiter,
+                      skipinitialspace):
         if not delimiter:
             raise Error("Could not determine delimiter")
 
@@ -203,7 +1156,8 @@ class Sniffer:
         return dialect
 
 
-    def _guess_quote_and_delimiter(self, data, delimiters):
+    @_profiled("quote_and_delimiter")
+    def _guess_quote_and_delimiter(self, data, delimiters, votes=None):
         """
         Looks for text enclosed between two identical quotes
         (the probable quotechar) which are preceded and followed
@@ -212,18 +1166,11 @@ class Sniffer:
                          ,'some text',
         The quote with the most wins, same with the delimiter.
         If there is no quotechar the delimiter can't be determined
-        this way.
+        this way.  votes, if given, is updated with how many quoted
+        fields each delimiter was found around.
         """
 
-        matches = []
-        for restr in ('(?P<delim>[^\w\n"\'])(?P<space> ?)(?P<quote>["\']).*?(?P=quote)(?P=delim)', # ,".*?",
-                      '(?:^|\n)(?P<quote>["\']).*?(?P=quote)(?P<delim>[^\w\n"\'])(?P<space> ?)',   #  ".*?",
-                      '(?P<delim>>[^\w\n"\'])(?P<space> ?)(?P<quote>["\']).*?(?P=quote)(?:$|\n)',  # ,".*?"
-                      '(?:^|\n)(?P<quote>["\']).*?(?P=quote)(?:$|\n)'):                            #  ".*?" (no delim, no space)
-            regexp = re.compile(restr, re.DOTALL | re.MULTILINE)
-            matches = regexp.findall(data)
-            if matches:
-                break
+        matches = _quoted_scan(data)
 
         if not matches:
             # (quotechar, doublequote, delimiter, skipinitialspace)
@@ -231,27 +1178,18 @@ class Sniffer:
         quotes = {}
         delims = {}
         spaces = 0
-        groupindex = regexp.groupindex
-        for m in matches:
-            n = groupindex['quote'] - 1
-            key = m[n]
-            if key:
-                quotes[key] = quotes.get(key, 0) + 1
-            try:
-                n = groupindex['delim'] - 1
-                key = m[n]
-            except KeyError:
-                continue
-            if key and (delimiters is None or key in delimiters):
-                delims[key] = delims.get(key, 0) + 1
-            try:
-                n = groupindex['space'] - 1
-            except KeyError:
+        for quote, delim, space in matches:
+            quotes[quote] = quotes.get(quote, 0) + 1
+            if delim is None:
                 continue
-            if m[n]:
+            if delim and (delimiters is None or delim in delimiters):
+                delims[delim] = delims.get(delim, 0) + 1
+            if space:
                 spaces += 1
 
         quotechar = max(quotes, key=quotes.get)
+        if votes is not None:
+            votes.update(item for item in delims.items() if item[0] != '\n')
 
         if delims:
             delim = max(delims, key=delims.get)
@@ -282,7 +1220,9 @@ class Sniffer:
         return (quotechar, doublequote, delim, skipinitialspace)
 
 
-    def _guess_delimiter(self, data, delimiters):
+    @_profiled("guess_delimiter")
+    def _guess_delimiter(self, data, delimiters, threshold=0.9,
+                         votes=None):
         """
         The delimiter /should/ occur the same number of times on
         each row. However, due to malformed data, it may not. We don't want
@@ -299,22 +1239,32 @@ class Sniffer:
         For performance reasons, the data is evaluated in chunks, so it can
         try and evaluate the smallest portion of the data possible, evaluating
         additional chunks as necessary.
+        data may also be an iterable of lines, which is then consumed
+        lazily, one chunk at a time.  votes, if given, is updated with the
+        number of consistent lines of each delimiter found (only of the
+        preferred ones, if any is among them).
         """
 
-        data = list(filter(None, data.split('\n')))
+        if isinstance(data, str):
+            data = data.split('\n')
+        data = filter(None, data)
 
         ascii = [chr(c) for c in range(127)] # 7-bit ASCII
 
         # build frequency tables
-        chunkLength = min(10, len(data))
+        chunk = list(islice(data, 10))
+        chunkLength = len(chunk)
+        firstLine = chunk[0] if chunk else ''
         iteration = 0
         charFrequency = {}
         modes = {}
         delims = {}
-        start, end = 0, min(chunkLength, len(data))
-        while start < len(data):
+        profile = self.profile
+        while chunk:
             iteration += 1
-            for line in data[start:end]:
+            if profile is not None:
+                start = time.perf_counter()
+            for line in chunk:
                 for char in ascii:
                     metaFrequency = charFrequency.get(char, {})
                     # must count even if frequency is 0
@@ -343,8 +1293,6 @@ class Sniffer:
             total = float(chunkLength * iteration)
             # (rows of consistent data) / (number of rows) = 100%
             consistency = 1.0
-            # minimum consistency threshold
-            threshold = 0.9
             while len(delims) == 0 and consistency >= threshold:
                 for k, v in modeList:
                     if v[0] > 0 and v[1] > 0:
@@ -353,16 +1301,23 @@ class Sniffer:
                             (delimiters is None or k in delimiters)):
                             delims[k] = v
                 consistency -= 0.01
+                if profile is not None:
+                    profile.threshold_steps += 1
+            if profile is not None:
+                profile._chunk(len(chunk), time.perf_counter() - start)
+            if votes is not None:
+                # the candidates the choice below is made between
+                preferred = [k for k in delims if k in self.preferred]
+                votes.update((k, delims[k][1]) for k in preferred or delims)
 
             if len(delims) == 1:
                 delim = list(delims.keys())[0]
-                skipinitialspace = (data[0].count(delim) ==
-                                    data[0].count("%c " % delim))
+                skipinitialspace = (firstLine.count(delim) ==
+                                    firstLine.count("%c " % delim))
                 return (delim, skipinitialspace)
 
             # analyze another chunkLength lines
-            start = end
-            end += chunkLength
+            chunk = list(islice(data, chunkLength))
 
         if not delims:
             return ('', 0)
@@ -371,8 +1326,8 @@ class Sniffer:
         if len(delims) > 1:
             for d in self.preferred:
                 if d in delims.keys():
-                    skipinitialspace = (data[0].count(d) ==
-                                        data[0].count("%c " % d))
+                    skipinitialspace = (firstLine.count(d) ==
+                                        firstLine.count("%c " % d))
                     return (d, skipinitialspace)
 
         # nothing else indicates a preference, pick the character that
@@ -382,12 +1337,13 @@ class Sniffer:
         items.sort()
         delim = items[-1][1]
 
-        skipinitialspace = (data[0].count(delim) ==
-                            data[0].count("%c " % delim))
+        skipinitialspace = (firstLine.count(delim) ==
+                            firstLine.count("%c " % delim))
         return (delim, skipinitialspace)
 
 
-    def has_header(self, sample):
+    @_profiled("has_header")
+    def has_header(self, sample, dialect=None):
         # Creates a dictionary of types of data in each column. If any
         # column is of a single type (say, integers), *except* for the first
         # row, then the first row is presumed to be labels. If the type
@@ -396,8 +1352,39 @@ class Sniffer:
         # rows except for the first are the same length, it's a header.
         # Finally, a 'vote' is taken at the end for each column, adding or
         # subtracting from the likelihood of the first row being a header.
+        # The sample is sniffed for its dialect unless one is given.
+        return self._inspect_header(sample, dialect, False)[0]
 
-        rdr = reader(StringIO(sample), self.sniff(sample))
+
+    def column_types(self, sample, dialect=None):
+        """
+        Returns the type of each column of sample, header row excluded
+
+        A column is int, float or complex when all of its cells parse as
+        that type (checked in that order, as has_header() does), str when
+        none of them is numeric, and None when they disagree.  The sample
+        is sniffed for its dialect unless one is given.
+        """
+
+        return self._inspect_header(sample, dialect, True)[1]
+
+
+    @_profiled("has_header")
+    def header_and_types(self, sample, dialect=None):
+        """
+        Returns has_header() and column_types() of sample as a pair
+
+        Both come from the same pass over the rows, so the types the
+        header vote is based on needn't be inferred again.
+        """
+
+        return self._inspect_header(sample, dialect, True)
+
+
+    def _inspect_header(self, sample, dialect, want_types):
+        # (has_header, column types); without want_types the types are
+        # None and the rows are only read until the vote is decided
+        rdr = reader(StringIO(sample), dialect or self.sniff(sample))
 
         header = next(rdr) # assume first row is header
 
@@ -406,6 +1393,11 @@ class Sniffer:
         columnTypes = {}
         # Loop body should be at new line
         for i in range(columns): columnTypes[i] = None
+        # the vote of each column as soon as its type is known
+        votes = {}
+        # what column_types() reports, _unknown until a cell is seen
+        types = [_unknown] * columns if want_types else None
+        voting = True
 
         checked = 0
         for row in rdr:
@@ -417,42 +1409,377 @@ class Sniffer:
             if len(row) != columns:
                 continue # skip rows that have irregular number of columns
 
+            if want_types:
+                cellTypes = [_cell_type(cell) for cell in row]
+                for col, cellType in enumerate(cellTypes):
+                    cellType = cellType or str
+                    if types[col] is _unknown:
+                        types[col] = cellType
+                    elif types[col] is not cellType:
+                        types[col] = None
+            if not voting:
+                continue
+
             for col in list(columnTypes.keys()):
 
-                for thisType in [int, float, complex]:
-                    try:
-                        thisType(row[col])
-                        break
-                    except (ValueError, OverflowError):
-                        pass
+                # fallback to length of string
+                if want_types:
+                    thisType = cellTypes[col] or len(row[col])
                 else:
-                    # fallback to length of string
-                    thisType = len(row[col])
+                    thisType = _cell_type(row[col]) or len(row[col])
 
                 if thisType != columnTypes[col]:
                     if columnTypes[col] is None: # add new column type
                         columnTypes[col] = thisType
+                        votes[col] = _header_vote(header[col], thisType)
                     else:
                         # type is inconsistent, remove column from
                         # consideration
                         del columnTypes[col]
+                        del votes[col]
+
+            # from here on columns can only drop out of the vote, so once
+            # none of them is in favour of a header the answer is final
+            if not any(vote > 0 for vote in votes.values()):
+                if not want_types:
+                    return False, None
+                voting = False
+
+        if want_types:
+            types = [None if t is _unknown else t for t in types]
+        if not voting:
+            return False, types
 
         # finally, compare results against first row and "vote"
         # on whether it's a header
         hasHeader = 0
         for col, colType in columnTypes.items():
-            # It's better to use `isinstance()` instead of type comparsion
-            if type(colType) == type(0): # it's a length
-                if len(header[col]) != colType:
-                    hasHeader += 1
-                else:
-                    hasHeader -= 1
-            else: # attempt typecast
-                try:
-                    colType(header[col])
-                except (ValueError, TypeError):
-                    hasHeader += 1
-                else:
-                    hasHeader -= 1
+            hasHeader += _header_vote(header[col], colType)
+
+        return hasHeader > 0, types
+
+
+class DialectCache:
+    """Remember sniffed dialects and header verdicts between runs.
 
-        return hasHeader > 0
+    Entries are keyed either by file identity (see file_key()) or by a
+    hash of the sample (see sample_key()), and hold the Dialect attributes
+    plus the has_header verdict.  At most maxsize entries are kept, the
+    least recently used being evicted first; entries older than max_age
+    seconds are dropped.  If filename is given the cache is loaded from
+    and saved to that JSON file.
+    """
+    attributes = ("delimiter", "quotechar", "escapechar", "doublequote",
+                  "skipinitialspace", "lineterminator", "quoting")
+
+    def __init__(self, filename=None, maxsize=1024, max_age=None):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        if filename is not None and os.path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                self._entries.update(json.load(f))
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def file_key(path, delimiters=None):
+        """Return a key that changes whenever the file at path does."""
+        st = os.stat(path)
+        key = "stat:%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_mtime_ns,
+                                    st.st_size)
+        if delimiters is not None:
+            key += ":" + delimiters
+        return key
+
+    @staticmethod
+    def sample_key(sample, delimiters=None):
+        """Return a key derived from the contents of sample."""
+        key = "sha1:" + hashlib.sha1(
+            sample.encode('utf-8', 'surrogatepass')).hexdigest()
+        if delimiters is not None:
+            key += ":" + delimiters
+        return key
+
+    def get(self, key):
+        """Return (dialect, has_header) for key, or None if unknown."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.max_age is not None and \
+           time.time() - entry["time"] > self.max_age:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+
+        class dialect(Dialect):
+            _name = "sniffed"
+        for name in self.attributes:
+            setattr(dialect, name, entry[name])
+        return dialect, entry["has_header"]
+
+    def put(self, key, dialect, has_header):
+        """Remember dialect and the has_header verdict under key."""
+        entry = {name: getattr(dialect, name) for name in self.attributes}
+        entry["has_header"] = has_header
+        entry["time"] = time.time()
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        if self.max_age is not None:
+            now = time.time()
+            for key in [key for key, entry in self._entries.items()
+                        if now - entry["time"] > self.max_age]:
+                del self._entries[key]
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def save(self):
+        """Write the cache to its file, if it has one."""
+        if self.filename is None:
+            return
+        tmp = self.filename + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.filename)
+
+
+def _sniff_region(sniffer, path, start, end, delimiters, encoding):
+    # may run in a worker process; returns the guess and its vote table
+    with open(path, 'rb') as f:
+        f.seek(start)
+        sample = f.read(end - start).decode(encoding, 'replace')
+    votes = {}
+    return sniffer._guess(sample, delimiters, votes), votes
+
+
+def _sniff_file(path, sample_bytes, delimiters, encoding):
+    # runs in a worker process; sniffed dialects are local classes which
+    # can't be pickled, so only their attributes are sent back
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes).decode(encoding, 'replace')
+    sniffer = Sniffer()
+    dialect = sniffer.sniff(sample, delimiters)
+    return ((dialect.quotechar, dialect.doublequote, dialect.delimiter,
+             dialect.skipinitialspace), sniffer.has_header(sample, dialect))
+
+
+def _cancel(futures):
+    # so that leaving the pool's with block only waits for running ones
+    for future in futures:
+        future.cancel()
+
+
+def sniff_many(paths, workers=None, sample_bytes=8192, delimiters=None,
+               encoding='utf-8', onerror=None, cache=None):
+    """Sniff the dialect and header of many files in parallel.
+
+    Yields a (path, dialect, has_header) tuple for each file as soon as it
+    is done, so results arrive in completion order.  Sniffing is CPU-bound
+    pure Python, so the first sample_bytes of every file are read and
+    sniffed by a pool of worker processes (workers of them, os.cpu_count()
+    by default).
+
+    If a file can't be read or sniffed, onerror is called with the path
+    and the exception, and the rest of the batch carries on.  Without
+    onerror, the exception is raised and the batch stops.
+
+    With a DialectCache as cache, files whose DialectCache.file_key() is
+    already known are answered from it at the cost of one os.stat(), and
+    newly sniffed files are added to it.
+    """
+    # imported here to keep "import csv" free of multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    sniffer = Sniffer()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for path in paths:
+            key = None
+            if cache is not None:
+                try:
+                    key = cache.file_key(path, delimiters)
+                except OSError as err:
+                    if onerror is None:
+                        _cancel(futures)
+                        raise
+                    onerror(path, err)
+                    continue
+                cached = cache.get(key)
+                if cached is not None:
+                    yield (path,) + cached
+                    continue
+            future = pool.submit(_sniff_file, path, sample_bytes, delimiters,
+                                 encoding)
+            futures[future] = path, key
+        for future in as_completed(futures):
+            path, key = futures[future]
+            try:
+                guess, has_header = future.result()
+            except Exception as err:
+                if onerror is None:
+                    _cancel(futures)
+                    raise
+                onerror(path, err)
+                continue
+            dialect = sniffer._make_dialect(*guess)
+            if key is not None:
+                cache.put(key, dialect, has_header)
+            yield path, dialect, has_header
+
+
+def _dialect_params(dialect):
+    # the formatting parameters of dialect as a plain, picklable dict
+    if isinstance(dialect, str):
+        dialect = get_dialect(dialect)
+    dialect = _Dialect(dialect)
+    return {name: getattr(dialect, name)
+            for name in ("delimiter", "quotechar", "escapechar",
+                         "doublequote", "skipinitialspace", "lineterminator",
+                         "quoting", "strict")}
+
+def _field_patterns(params, encoding):
+    # what _quote_state() looks for, in the encoded bytes of the file
+    quote = escape = None
+    if params["quoting"] != QUOTE_NONE and params["quotechar"]:
+        quote = re.escape(params["quotechar"].encode(encoding))
+    if params["escapechar"]:
+        escape = re.escape(params["escapechar"].encode(encoding))
+    if quote is None and escape is None:
+        return None
+    space = b' *' if params["skipinitialspace"] else b''
+    delimiter = re.escape(params["delimiter"].encode(encoding))
+    pair = [b'(?P<esc>' + escape + b'.)'] if escape else []
+    # a quote only opens a field at its start, and only closes it inside
+    outside = pair + ([b'(?:[\r\n]|' + delimiter + b')' + space + quote]
+                      if quote else [])
+    inside = pair + ([quote] if quote else [])
+    return (re.compile(b'|'.join(outside), re.DOTALL),
+            re.compile(b'|'.join(inside), re.DOTALL),
+            re.compile(space + quote) if quote else None,
+            quote and params["quotechar"].encode(encoding),
+            escape and params["escapechar"].encode(encoding),
+            params["doublequote"])
+
+def _quote_state(buf, quoted, escaped, patterns):
+    # (inside a quoted field, final newline escaped) at the end of a slice
+    # of the file which starts a line, given the same at its start
+    outside, inside, opening, quote, escape, doublequote = patterns
+    pos = 0
+    if not quoted and not escaped and opening is not None:
+        # the slice starts a record, and so a field
+        match = opening.match(buf)
+        if match:
+            quoted = True
+            pos = match.end()
+    escaped = False
+    while True:
+        match = (inside if quoted else outside).search(buf, pos)
+        if match is None:
+            return quoted, escaped
+        pos = match.end()
+        if match.lastgroup == 'esc':
+            escaped = pos == len(buf)
+        elif not quoted:
+            quoted = True
+        elif doublequote and buf[pos:pos + len(quote)] == quote:
+            # a doubled quote stays within the field
+            pos += len(quote)
+        else:
+            quoted = False
+            if doublequote and escape and \
+               buf[pos:pos + len(escape)] == escape:
+                # right after the closing quote, _csv takes an escapechar
+                # as it is, waiting to see whether a quote follows
+                pos += len(escape)
+
+def _chunk_bounds(mm, chunk_size, patterns):
+    # Yields (start, end) offsets of chunks of about chunk_size bytes that
+    # end right after a newline which is neither quoted nor escaped.
+    size = len(mm)
+    start = 0
+    while start < size:
+        end = mm.find(b'\n', min(start + chunk_size, size) - 1) + 1 or size
+        quoted = escaped = False
+        if patterns is not None:
+            quoted, escaped = _quote_state(mm[start:end], False, False,
+                                           patterns)
+            while end < size and (quoted or escaped):
+                following = mm.find(b'\n', end) + 1 or size
+                quoted, escaped = _quote_state(mm[end:following], quoted,
+                                               escaped, patterns)
+                end = following
+        yield start, end
+        start = end
+
+def _read_chunk(path, start, end, params, encoding):
+    # runs in a worker process
+    with open(path, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(encoding)
+    return list(reader(StringIO(text, newline=''), **params))
+
+
+def parallel_reader(path, dialect=None, workers=None, chunk_size=1 << 24,
+                    ordered=True, batches=False, encoding='utf-8'):
+    """Read the CSV file at path with a pool of worker processes.
+
+    The file is memory-mapped and cut into chunks of about chunk_size
+    bytes, each ending on a record boundary that respects the dialect's
+    quotechar and escapechar, so quoted newlines stay within their record.
+    The chunks are parsed with reader() by a pool of worker processes
+    (workers of them, os.cpu_count() by default) and their rows are
+    returned in file order, or as chunks complete when ordered is false.
+    With batches, each chunk's list of rows is returned as a whole.
+
+    dialect is sniffed from the head of the file if not given.  encoding
+    must be ASCII compatible (such as UTF-8 or Latin-1), so that record
+    boundaries can be found in the raw bytes.
+    """
+    chunks = _parallel_chunks(path, dialect, workers, chunk_size, ordered,
+                              encoding)
+    if batches:
+        return chunks
+    return chain.from_iterable(chunks)
+
+def _parallel_chunks(path, dialect, workers, chunk_size, ordered, encoding):
+    # imported here to keep "import csv" free of multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if dialect is None:
+                dialect = Sniffer().sniff(
+                    mm[:1 << 16].decode(encoding, 'ignore'))
+            params = _dialect_params(dialect)
+            patterns = _field_patterns(params, encoding)
+
+            # a couple of chunks in flight per worker keep them all busy
+            # without piling up parsed rows
+            limit = 2 * (workers or os.cpu_count() or 1)
+            pending = deque()
+
+            def finished():
+                # the oldest chunk, or whichever one is done first
+                if ordered:
+                    return pending.popleft().result()
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+                return future.result()
+
+            with ProcessPoolExecutor(workers) as pool:
+                for start, end in _chunk_bounds(mm, chunk_size, patterns):
+                    pending.append(pool.submit(_read_chunk, path, start, end,
+                                               params, encoding))
+                    if len(pending) >= limit:
+                        yield finished()
+                while pending:
+                    yield finished()
@@ -1,4 +1,122 @@
-from collections import defaultdict
+import time
+from collections import Counter
+from itertools import islice, repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Chunks shorter than this (in characters) are counted with Counter, as
+# NumPy's setup cost only pays off on long lines.
+_NUMPY_MIN_CHUNK = 1 << 16
+
+
+def _line_histograms(chunk):
+    """Return an iterable of {char: count} mappings, one per line."""
+    if numpy is None or sum(map(len, chunk)) < _NUMPY_MIN_CHUNK:
+        return map(Counter, chunk)
+    return _numpy_line_histograms(chunk)
+
+
+def _numpy_line_histograms(chunk):
+    # only 7-bit ASCII is tracked, so everything else can be dropped
+    encoded = [line.encode('ascii', 'ignore') for line in chunk]
+    codes = numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8)
+    rows = numpy.repeat(numpy.arange(len(encoded)),
+                        [len(line) for line in encoded])
+    table = numpy.bincount(rows * 128 + codes,
+                           minlength=len(encoded) * 128)
+    for counts in table.reshape(len(encoded), 128):
+        yield {chr(c): int(counts[c]) for c in numpy.flatnonzero(counts)}
+
+
+def _consistency_levels(threshold):
+    # (rows of consistent data) / (number of rows), stepped down from 100%
+    # exactly as the floating point subtraction does it
+    levels = []
+    consistency = 1.0
+    while consistency >= threshold:
+        levels.append(consistency)
+        consistency -= 0.01
+    return tuple(levels)
+
+# minimum consistency threshold is 0.9
+_CONSISTENCY_LEVELS = _consistency_levels(0.9)
+
+
+class DelimiterStats:
+    """
+    Running meta-frequency tables used to guess a delimiter.
+
+    For every 7-bit ASCII character it counts the lines on which that
+    character occurs a given number of times, and keeps the mode of those
+    counts up to date as lines are added, so a new chunk only touches the
+    buckets it changes.  Instances can be pickled and resumed later with
+    more lines.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        # char -> {char count per line: lines}
+        self.char_frequency = {chr(c): {} for c in range(127)}
+        # char -> {char count per line: order of first appearance}
+        self._order = {char: {} for char in self.char_frequency}
+        # char -> (char count per line, lines) of the most common bucket
+        self._mode = {}
+        # char -> mode adjusted by the sum of all other frequencies
+        self.modes = {}
+
+    def _add(self, char, freq, lines):
+        meta_freq = self.char_frequency[char]
+        order = self._order[char]
+        if freq not in order:
+            order[freq] = len(order)
+        count = meta_freq[freq] = meta_freq.get(freq, 0) + lines
+        mode = self._mode.get(char)
+        if (mode is None or freq == mode[0] or count > mode[1] or
+                (count == mode[1] and order[freq] < order[mode[0]])):
+            self._mode[char] = (freq, count)
+
+    def update(self, chunk):
+        """Add the lines of chunk to the tables and refresh modes."""
+        # Each line is histogrammed in a single pass and its
+        # (char, count per line) pairs are tallied for the whole chunk, so
+        # every bucket is touched once per chunk.  The zero buckets are
+        # derived from the number of lines each character was missing from.
+        pairs = Counter()
+        # A character gets its zero bucket on the first line it is missing
+        # from, to keep the bucket order (and so the tie-breaking of the
+        # mode) identical to counting line by line.
+        no_zero = {char for char, meta_freq in self.char_frequency.items()
+                   if 0 not in meta_freq}
+        for counts in _line_histograms(chunk):
+            pairs.update(counts.items())
+            if no_zero:
+                missing = no_zero.difference(counts)
+                pairs.update(zip(missing, repeat(0)))
+                no_zero -= missing
+
+        zeros = dict.fromkeys(self.char_frequency, len(chunk))
+        seen = set()
+        for (char, freq), lines in pairs.items():
+            if char in zeros:
+                self._add(char, freq, lines)
+                zeros[char] -= lines
+                if freq:
+                    seen.add(char)
+        for char, lines in zeros.items():
+            # must count even if frequency is 0
+            if lines:
+                self._add(char, 0, lines)
+        self.lines += len(chunk)
+
+        # characters that never occurred have no mode worth considering
+        for char in sorted(seen.difference(self.modes)):
+            self.modes[char] = None
+        for char in self.modes:
+            per_line, lines = self._mode[char]
+            self.modes[char] = (per_line, 2 * lines - self.lines)
 
 
 class Sniffer:
@@ -7,48 +125,35 @@ class Sniffer:
     # Some code above
     #
 
-    def _update_char_frequency(self, chunk, char_frequency):
-        for line in chunk:
-            for char in char_frequency:
-                # must count even if frequency is 0
-                freq = line.count(char)
-                char_frequency[char][freq] += 1
-
-    def _update_modes(self, modes, char_frequency):
-        for char, meta_freq in char_frequency.items():
-            items = list(meta_freq.items())
-            # items - (char count per line, lines)
-            if len(items) == 1 and items[0][0] == 0:
-                continue
-            # get the mode of the frequencies
-            if len(items) > 1:
-                modes[char] = max(items, key=lambda x: x[1])
-                # adjust the mode - subtract the sum of all
-                # other frequencies
-                items.remove(modes[char])
-                modes[char] = (modes[char][0],
-                               modes[char][1] - sum(item[1] for item in items))
-            else:
-                modes[char] = items[0]
+    # a csv.SniffProfile collecting timings, if any
+    profile = None
 
     def _update_delims(self, delims, total, modes, delimiters):
-        # (rows of consistent data) / (number of rows) = 100%
-        consistency = 1.0
-        # minimum consistency threshold
-        threshold = 0.9
-        while len(delims) == 0 and consistency >= threshold:
-            for char, (per_line, lines_count) in modes.items():
-                if per_line > 0 and lines_count > 0:
-                    consistency_is_ok = (lines_count / total) >= consistency
-                    char_is_allowed = delimiters is None or char in delimiters
-                    if consistency_is_ok and char_is_allowed:
+        # Only runs while no delimiter has been found.  Every candidate
+        # passing the first consistency level that any of them passes is
+        # added, so one pass finds the best ratio and the level is looked
+        # up from it, instead of trying each level in turn.
+        if delims:
+            return
+        candidates = [(char, per_line, lines_count)
+                      for char, (per_line, lines_count) in modes.items()
+                      if per_line > 0 and lines_count > 0 and
+                      (delimiters is None or char in delimiters)]
+        best = max([lines_count / total
+                    for _, _, lines_count in candidates], default=0.0)
+        for steps, consistency in enumerate(_CONSISTENCY_LEVELS, 1):
+            if best >= consistency:
+                for char, per_line, lines_count in candidates:
+                    if lines_count / total >= consistency:
                         delims[char] = per_line, lines_count
-            consistency -= 0.01
+                break
+        if self.profile is not None:
+            self.profile.threshold_steps += steps
 
     def _determine_skipinitialspace(self, lines, delim):
         return lines[0].count(delim) == lines[0].count("%c " % delim)
 
-    def _guess_delimiter(self, data, delimiters):
+    def _guess_delimiter(self, data, delimiters, stats=None):
         """
         The delimiter /should/ occur the same number of times on
         each row. However, due to malformed data, it may not. We don't want
@@ -65,32 +170,41 @@ class Sniffer:
         For performance reasons, the data is evaluated in chunks, so it can
         try and evaluate the smallest portion of the data possible, evaluating
         additional chunks as necessary.
+        Passing a DelimiterStats as stats resumes from the lines it already
+        holds; it is left updated with the lines evaluated here.  data may
+        also be an iterable of lines, which is then consumed lazily.
         """
 
-        data = list(filter(None, data.split('\n')))
+        if isinstance(data, str):
+            data = data.split('\n')
+        data = filter(None, data)
 
         # build frequency tables
-        char_frequency = {chr(c): defaultdict(int) for c in range(127)}
-        chunk_length = min(10, len(data))
-        modes = {}
+        if stats is None:
+            stats = DelimiterStats()
+        base = stats.lines
+        chunk = head = list(islice(data, 10))
+        chunk_length = end = len(chunk)
         delims = {}
-        start, end = 0, min(chunk_length, len(data))
-        while start < len(data):
-            chunk = data[start:end]
-            total = end
+        profile = self.profile
+        while chunk:
+            total = base + end
 
-            self._update_char_frequency(chunk, char_frequency)
-            self._update_modes(modes, char_frequency)
-            self._update_delims(delims, total, modes, delimiters)
+            if profile is not None:
+                start = time.perf_counter()
+            stats.update(chunk)
+            self._update_delims(delims, total, stats.modes, delimiters)
+            if profile is not None:
+                profile._chunk(len(chunk), time.perf_counter() - start)
 
             if len(delims) == 1:
                 delim = list(delims.keys())[0]
-                skipinitialspace = self._determine_skipinitialspace(data,
+                skipinitialspace = self._determine_skipinitialspace(head,
                                                                     delim)
                 return (delim, skipinitialspace)
 
             # analyze another chunk_length lines
-            start = end
+            chunk = list(islice(data, chunk_length))
             end += chunk_length
 
         if not delims:
@@ -100,7 +214,7 @@ class Sniffer:
         if len(delims) > 1:
             for d in self.preferred:
                 if d in delims:
-                    skipinitialspace = self._determine_skipinitialspace(data,
+                    skipinitialspace = self._determine_skipinitialspace(head,
                                                                         d)
                     return (d, skipinitialspace)
 
@@ -109,5 +223,5 @@ class Sniffer:
         items = delims.items()
         delim, _ = max(items, key=lambda x: x[1][1])
 
-        skipinitialspace = self._determine_skipinitialspace(data, d)
+        skipinitialspace = self._determine_skipinitialspace(head, d)
         return (delim, skipinitialspace)
@@ -0,0 +1,464 @@
+"""
+csvbench.py - micro-benchmarks for the csv and csv2 modules
+
+Run as a script:  python csvbench.py [name ...]
+
+The "suite" benchmark times every entry point on every synthetic corpus;
+add --save FILE to keep its results as a JSON baseline and --baseline FILE
+to flag entries slower than that baseline by more than --threshold.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import csv
+import csv2
+
+__all__ = ["timeit", "make_sample", "bench_char_frequency",
+           "bench_quote_scan", "bench_dictwriter", "bench_parallel_reader",
+           "bench_usecols", "bench_where", "bench_update_delims",
+           "CORPORA", "make_corpus", "ENTRY_POINTS", "measure", "run_suite",
+           "save_baseline", "load_baseline", "compare", "bench_suite"]
+
+
+def timeit(func, *args, repeat=3):
+    """Return the best wall-clock time of func(*args) over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_sample(size, columns=8, delimiter=',', seed=0):
+    """Return a CSV-ish sample of roughly size characters."""
+    rnd = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789 '
+    lines = []
+    total = 0
+    while total < size:
+        line = delimiter.join(
+            ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 12)))
+            for _ in range(columns))
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines)
+
+
+def _count_per_char(chunk, char_frequency):
+    # the original str.count() loop, kept as the reference point
+    for line in chunk:
+        for char in char_frequency:
+            freq = line.count(char)
+            char_frequency[char][freq] += 1
+
+
+def bench_char_frequency(sizes=(1 << 10, 1 << 16, 1 << 20, 10 << 20)):
+    """Histogram a whole sample with str.count() and with csv2."""
+    for size in sizes:
+        lines = make_sample(size).split('\n')
+        def run():
+            _count_per_char(lines,
+                            {chr(c): defaultdict(int) for c in range(127)})
+        old = timeit(run, repeat=1)
+        new = timeit(csv2.DelimiterStats().update, lines, repeat=1)
+        print("char_frequency %9d bytes: count %.4fs  histogram %.4fs  "
+              "x%.1f" % (size, old, new, old / new))
+
+
+_quote_patterns = [re.compile(restr, re.DOTALL | re.MULTILINE) for restr in (
+    r'(?P<delim>[^\w\n"\'])(?P<space> ?)(?P<quote>["\']).*?(?P=quote)(?P=delim)',
+    r'(?:^|\n)(?P<quote>["\']).*?(?P=quote)(?P<delim>[^\w\n"\'])(?P<space> ?)',
+    r'(?P<delim>>[^\w\n"\'])(?P<space> ?)(?P<quote>["\']).*?(?P=quote)(?:$|\n)',
+    r'(?:^|\n)(?P<quote>["\']).*?(?P=quote)(?:$|\n)')]
+
+
+def _quoted_regexp(data):
+    # the original findall() of each pattern in turn, kept as the reference
+    # point for csv._quoted_scan()
+    for regexp in _quote_patterns:
+        matches = regexp.findall(data)
+        if matches:
+            break
+    else:
+        return []
+    groupindex = regexp.groupindex
+    if 'delim' not in groupindex:
+        return [(m, None, None) for m in matches]
+    return [(m[groupindex['quote'] - 1], m[groupindex['delim'] - 1],
+             m[groupindex['space'] - 1]) for m in matches]
+
+
+def bench_quote_scan(sizes=(1 << 10, 1 << 12, 1 << 14, 1 << 16)):
+    """Find quoted fields in samples full of unbalanced quotes."""
+    for size in sizes:
+        # every opening quote is left unclosed, so each findall() start
+        # position runs to the end of the sample before failing
+        sample = ('a,"b,c\n' * (size // 7))[:size]
+        old = timeit(_quoted_regexp, sample, repeat=1)
+        new = timeit(csv._quoted_scan, sample, repeat=1)
+        print("quote_scan %9d bytes: regexp %.4fs  scan %.4fs  x%.1f"
+              % (size, old, new, old / new))
+
+
+class _ListDictWriter(csv.DictWriter):
+    # the original list-scanning _dict_to_list, kept as the reference point
+    def _dict_to_list(self, rowdict):
+        if self.extrasaction == "raise":
+            wrong_fields = [k for k in rowdict if k not in self.fieldnames]
+            if wrong_fields:
+                raise ValueError("dict contains fields not in fieldnames: "
+                                 + ", ".join([repr(x) for x in wrong_fields]))
+        return (rowdict.get(key, self.restval) for key in self.fieldnames)
+
+
+def bench_dictwriter(widths=(10, 100, 1000), cells=200000):
+    """Write the same rows with the DictWriter paths and the old one."""
+    for width in widths:
+        fieldnames = ["field%d" % i for i in range(width)]
+        rows = [[str(i)] * width for i in range(cells // width)]
+        dicts = [dict(zip(fieldnames, row)) for row in rows]
+        def run(cls, method, data, buffer_size=None):
+            w = cls(io.StringIO(), fieldnames, buffer_size=buffer_size)
+            getattr(w, method)(data)
+            w.flush()
+        old = timeit(run, _ListDictWriter, "writerows", dicts)
+        new = timeit(run, csv.DictWriter, "writerows", dicts)
+        fast = timeit(run, csv.DictWriter, "writerows_fast", rows)
+        buffered = timeit(run, csv.DictWriter, "writerows", dicts, 1 << 20)
+        print("dictwriter %4d columns: list %.4fs  set %.4fs  fast %.4fs  "
+              "buffered %.4fs" % (width, old, new, fast, buffered))
+
+
+def bench_parallel_reader(size=32 << 20, chunk_size=1 << 22):
+    """Read one file with csv.reader and with 1..cpu_count() workers."""
+    rnd = random.Random(0)
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='',
+                                     delete=False) as f:
+        w = csv.writer(f)
+        while f.tell() < size:
+            # one field in twenty has a quoted newline
+            w.writerows([["%d" % rnd.randint(0, 10**6), "line\nbreak"
+                          if rnd.random() < 0.05 else "plain", "x" * 20]
+                         for _ in range(1000)])
+    try:
+        def serial():
+            with open(f.name, newline='') as g:
+                for _ in csv.reader(g):
+                    pass
+        print("parallel_reader %d bytes: reader %.3fs"
+              % (size, timeit(serial, repeat=1)))
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            def parallel():
+                for _ in csv.parallel_reader(f.name, "excel", workers,
+                                             chunk_size, batches=True):
+                    pass
+            print("parallel_reader %d bytes: %2d workers %.3fs"
+                  % (size, workers, timeit(parallel, repeat=1)))
+            workers *= 2
+    finally:
+        os.unlink(f.name)
+
+
+def bench_usecols(width=100, rows=20000, fractions=(0.01, 0.1, 0.5, 1.0)):
+    """Read a wide file whole and cut down to a share of its columns."""
+    fieldnames = ["field%d" % i for i in range(width)]
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(fieldnames)
+    w.writerows([str(i)] * width for i in range(rows))
+    data = out.getvalue()
+    def run(usecols):
+        for _ in csv.DictReader(io.StringIO(data), usecols=usecols):
+            pass
+    full = timeit(run, None)
+    print("usecols %d columns: all %.4fs" % (width, full))
+    for fraction in fractions:
+        usecols = fieldnames[::round(1 / fraction)]
+        elapsed = timeit(run, usecols)
+        print("usecols %3d/%d columns: %.4fs  x%.1f"
+              % (len(usecols), width, elapsed, full / elapsed))
+
+
+def bench_where(width=20, rows=100000, selectivities=(0.001, 0.01, 0.1, 1.0)):
+    """Filter rows after building dicts and with DictReader(where=...)."""
+    fieldnames = ["field%d" % i for i in range(width)]
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(fieldnames)
+    rnd = random.Random(0)
+    w.writerows([str(rnd.random())] + [str(i)] * (width - 1)
+                for i in range(rows))
+    data = out.getvalue()
+    for selectivity in selectivities:
+        def test(value):
+            return float(value) < selectivity
+        def after():
+            for row in csv.DictReader(io.StringIO(data)):
+                if test(row["field0"]):
+                    pass
+        def pushed():
+            for _ in csv.DictReader(io.StringIO(data),
+                                    where={"field0": test}):
+                pass
+        old = timeit(after)
+        new = timeit(pushed)
+        print("where %5.1f%% of rows: dict then filter %.4fs  where %.4fs  "
+              "x%.1f" % (selectivity * 100, old, new, old / new))
+
+
+class _StepwiseSniffer(csv2.Sniffer):
+    # the original 0.01-step descent, kept as the reference point
+    preferred = [',', '\t', ';', ' ', ':']
+
+    def _update_delims(self, delims, total, modes, delimiters):
+        consistency = 1.0
+        threshold = 0.9
+        while len(delims) == 0 and consistency >= threshold:
+            for char, (per_line, lines_count) in modes.items():
+                if per_line > 0 and lines_count > 0:
+                    consistency_is_ok = (lines_count / total) >= consistency
+                    char_is_allowed = delimiters is None or char in delimiters
+                    if consistency_is_ok and char_is_allowed:
+                        delims[char] = per_line, lines_count
+            consistency -= 0.01
+
+
+class _DirectSniffer(csv2.Sniffer):
+    preferred = _StepwiseSniffer.preferred
+
+
+def bench_update_delims(widths=(10, 40, 120), lines=2000):
+    """Guess delimiters of samples where no character is consistent."""
+    rnd = random.Random(0)
+    for width in widths:
+        # every line uses a random number of many different characters,
+        # so all consistency levels are tried on every chunk
+        chars = [chr(c) for c in range(33, 127)][:width]
+        sample = '\n'.join(
+            ''.join(rnd.choice(chars) for _ in range(rnd.randint(1, width)))
+            for _ in range(lines))
+        stats = csv2.DelimiterStats()
+        stats.update(sample.split('\n'))
+        modes = stats.modes
+        def run(sniffer):
+            for _ in range(1000):
+                sniffer._update_delims({}, lines, modes, None)
+        old = timeit(run, _StepwiseSniffer())
+        new = timeit(run, _DirectSniffer())
+        print("update_delims %3d candidates x1000: steps %.4fs  direct %.4fs"
+              "  x%.1f" % (len(modes), old, new, old / new))
+        old = timeit(_StepwiseSniffer()._guess_delimiter, sample, None)
+        new = timeit(_DirectSniffer()._guess_delimiter, sample, None)
+        print("update_delims %3d candidates, _guess_delimiter: %.4fs  %.4fs"
+              % (len(modes), old, new))
+
+
+# name -> (rows, columns, delimiter, quoting, ragged)
+CORPORA = {
+    "narrow": (50000, 4, ',', csv.QUOTE_MINIMAL, False),
+    "wide": (2000, 200, ',', csv.QUOTE_MINIMAL, False),
+    "quoted": (20000, 10, ',', csv.QUOTE_ALL, False),
+    "ragged": (20000, 10, ',', csv.QUOTE_MINIMAL, True),
+    "semicolon": (20000, 10, ';', csv.QUOTE_MINIMAL, False),
+    "tab": (20000, 10, '\t', csv.QUOTE_MINIMAL, False),
+    "pipe": (20000, 10, '|', csv.QUOTE_MINIMAL, False),
+}
+
+
+def make_corpus(name, seed=0):
+    """Return (fieldnames, rows, text) of the named corpus in CORPORA."""
+    nrows, columns, delimiter, quoting, ragged = CORPORA[name]
+    rnd = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta, inc", 'say "hi"', "x y z"]
+    fieldnames = ["col%d" % i for i in range(columns)]
+    rows = []
+    for i in range(nrows):
+        row = [str(i), "%.2f" % rnd.uniform(0, 1000)]
+        row += [rnd.choice(words) for _ in range(columns - 2)]
+        if ragged:
+            del row[rnd.randint(1, columns):]
+        rows.append(row)
+    out = io.StringIO()
+    w = csv.writer(out, delimiter=delimiter, quoting=quoting,
+                   lineterminator='\n')
+    w.writerow(fieldnames)
+    w.writerows(rows)
+    return fieldnames, rows, out.getvalue()
+
+
+# a sample as large as one a caller would typically sniff
+_SNIFF_BYTES = 1 << 16
+
+
+def _sniff(fieldnames, rows, text):
+    csv.Sniffer().sniff(text[:_SNIFF_BYTES])
+
+
+def _sniff_csv2(fieldnames, rows, text):
+    _DirectSniffer()._guess_delimiter(text[:_SNIFF_BYTES], None)
+
+
+def _has_header(fieldnames, rows, text):
+    csv.Sniffer().has_header(text[:_SNIFF_BYTES])
+
+
+def _reader(fieldnames, rows, text):
+    for _ in csv.reader(io.StringIO(text), _corpus_dialect(text)):
+        pass
+
+
+def _dictreader(fieldnames, rows, text):
+    for _ in csv.DictReader(io.StringIO(text), dialect=_corpus_dialect(text)):
+        pass
+
+
+def _dictwriter(fieldnames, rows, text):
+    w = csv.DictWriter(io.StringIO(), fieldnames, restval='',
+                       dialect=_corpus_dialect(text))
+    w.writeheader()
+    w.writerows(dict(zip(fieldnames, row)) for row in rows)
+
+
+def _corpus_dialect(text):
+    # the corpora are written with csv.writer defaults apart from these
+    delimiter = next(d for d in ',;\t|' if d in text.partition('\n')[0])
+    return csv.excel if delimiter == ',' else type(
+        "corpus", (csv.excel,), {"delimiter": delimiter})
+
+
+# name -> (func(fieldnames, rows, text), whether it only sees a sample)
+ENTRY_POINTS = {
+    "Sniffer.sniff": (_sniff, True),
+    "csv2.Sniffer._guess_delimiter": (_sniff_csv2, True),
+    "Sniffer.has_header": (_has_header, True),
+    "reader": (_reader, False),
+    "DictReader": (_dictreader, False),
+    "DictWriter": (_dictwriter, False),
+}
+
+
+def measure(func, args, nrows, nbytes, repeat=3):
+    """Time func(*args) and return its seconds, rows/s, bytes/s and peak.
+
+    The peak memory allocated while it runs is taken from a separate run
+    under tracemalloc, so tracing doesn't slow down the timed runs.
+    """
+    seconds = timeit(func, *args, repeat=repeat)
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "rows_per_s": nrows / seconds,
+            "bytes_per_s": nbytes / seconds, "peak_bytes": peak}
+
+
+def run_suite(corpora=None, entries=None, repeat=5):
+    """Measure each entry point on each corpus; keys are "entry/corpus"."""
+    results = {}
+    for name in corpora or CORPORA:
+        fieldnames, rows, text = make_corpus(name)
+        for entry in entries or ENTRY_POINTS:
+            func, sampled = ENTRY_POINTS[entry]
+            if sampled:
+                # the rows and bytes the sample holds
+                nbytes = min(len(text), _SNIFF_BYTES)
+                nrows = text.count('\n', 0, nbytes)
+            else:
+                nbytes = len(text)
+                nrows = len(rows)
+            results["%s/%s" % (entry, name)] = measure(
+                func, (fieldnames, rows, text), nrows, nbytes, repeat)
+    return results
+
+
+def save_baseline(results, path):
+    """Write results to path as JSON, with the Python that produced them."""
+    with open(path, 'w') as f:
+        json.dump({"python": platform.python_version(),
+                   "machine": platform.machine(),
+                   "results": results}, f, indent=1, sort_keys=True)
+
+
+def load_baseline(path):
+    """Return the results saved in path by save_baseline()."""
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(results, baseline, threshold=0.25):
+    """Return (key, old seconds, new seconds) for each regression.
+
+    An entry regresses when it is slower than in baseline by more than
+    threshold (a fraction, 0.25 being 25%).  Entries missing from either
+    side are ignored.
+    """
+    regressions = []
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old and new["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append((key, old["seconds"], new["seconds"]))
+    return regressions
+
+
+def bench_suite(baseline=None, save=None, threshold=0.25):
+    """Run the suite, optionally saving it and checking it for regressions.
+
+    Returns the regressions found against baseline (a path).
+    """
+    results = run_suite()
+    for key, r in results.items():
+        print("suite %-45s %8.4fs %10.0f rows/s %6.2f MB/s %8.0f KB peak"
+              % (key, r["seconds"], r["rows_per_s"], r["bytes_per_s"] / 1e6,
+                 r["peak_bytes"] / 1024))
+    if save:
+        save_baseline(results, save)
+    regressions = []
+    if baseline:
+        regressions = compare(results, load_baseline(baseline), threshold)
+        for key, old, new in regressions:
+            print("REGRESSION %s: %.4fs -> %.4fs (+%.0f%%)"
+                  % (key, old, new, (new / old - 1) * 100))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("names", nargs="*", help="benchmarks to run")
+    parser.add_argument("--save", metavar="FILE",
+                        help="save the suite results as a JSON baseline")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="flag suite regressions against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="slowdown flagged as a regression (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    names = args.names or [name[6:] for name in __all__
+                           if name.startswith("bench_")]
+    failed = False
+    for name in names:
+        if name == "suite":
+            failed |= bool(bench_suite(args.baseline, args.save,
+                                       args.threshold))
+        else:
+            globals()["bench_" + name]()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
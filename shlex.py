@@ -10,14 +10,110 @@ import os
 import re
 import sys
 from collections import deque
+from functools import lru_cache
+from itertools import chain
 
 from io import StringIO
 
-__all__ = ["shlex", "split", "quote"]
+__all__ = ["shlex", "split", "iter_spans", "quote", "quote_many", "join"]
+
+_WORDCHARS = ('abcdfeghijklmnopqrstuvwxyz'
+              'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+_POSIX_WORDCHARS = _WORDCHARS + ('ßàáâãäåæçèéêëìíîïðñòóôõöøùúûüýþÿ'
+                                 'ÀÁÂÃÄÅÆÇÈÉÊËÌÍÎÏÐÑÒÓÔÕÖØÙÚÛÜÝÞ')
+
+# character classes of the lexer, in the order read_token() tests them
+_WHITESPACE, _COMMENT, _QUOTE, _ESCAPE, _WORD, _PUNCT = range(6)
+
+
+def _char_class(chars):
+    # the inside of a regexp character class matching any of chars
+    return ''.join(sorted(map(re.escape, set(chars))))
+
+
+def _class_regexp(table, default, cls):
+    # a regexp matching one character of class cls, or None if none is
+    if default == cls:
+        others = [char for char, c in table.items() if c != cls]
+        return '[^%s]' % _char_class(others) if others else '(?s:.)'
+    chars = [char for char, c in table.items() if c == cls]
+    return '[%s]' % _char_class(chars) if chars else None
+
+
+class _LexerSpec:
+    """Lookup tables and run regexps for one shlex configuration.
+
+    read_token() tests a character against the shlex attributes in a
+    fixed order; the tables hold the outcome for each character once.
+    blank classifies the characters seen between tokens and word those
+    seen inside a word.  Characters missing from both tables are of the
+    default class.
+    """
+
+    def __init__(self, wordchars, whitespace, commenters, quotes, escape,
+                 escapedquotes, whitespace_split, posix):
+        self.quotes = quotes
+        self.escape = escape
+        self.escapedquotes = escapedquotes
+        self.posix = posix
+        self.default = other = _WORD if whitespace_split else _PUNCT
+
+        self.blank = {}
+        self.word = {}
+        for char in set(wordchars + whitespace + commenters + quotes +
+                        escape):
+            # the later assignments are the ones read_token() tests first
+            if char in quotes:
+                self.blank[char] = _QUOTE
+                self.word[char] = _QUOTE if posix else _WORD
+            if char in wordchars:
+                self.blank[char] = self.word[char] = _WORD
+            if posix and char in escape:
+                self.blank[char] = self.word[char] = _ESCAPE
+            if posix and char in quotes:
+                self.word[char] = _QUOTE
+            if char in commenters:
+                self.blank[char] = self.word[char] = _COMMENT
+            if char in whitespace:
+                self.blank[char] = self.word[char] = _WHITESPACE
+
+        space = '[%s]' % _char_class(whitespace) if whitespace else None
+        first = _class_regexp(self.blank, other, _WORD)
+        rest = _class_regexp(self.word, other, _WORD)
+        self.whitespace_run = re.compile(space + '+') if space else None
+        self.word_run = re.compile(rest + '+') if rest else None
+        # a whole unquoted word and the whitespace around it, which is most
+        # tokens of a command line
+        self.plain_token = None
+        if space and first:
+            word = first + rest + '*' if rest else first
+            self.plain_token = re.compile('%s*(%s)%s' % (space, word, space)
+                                          ).match
+        # with whitespace_split, a string without any of these characters
+        # is split into its word runs, whatever the state
+        special = [char for char in self.blank
+                   if self.blank[char] not in (_WORD, _WHITESPACE) or
+                   self.word[char] not in (_WORD, _WHITESPACE)]
+        self.find_special = None
+        if whitespace_split:
+            self.find_special = re.compile('[%s]' % _char_class(special)
+                                           if special else '(?!)').search
+        # per quote, the characters that don't end its run
+        self.quoted_run = {}
+        for quote in quotes:
+            stop = quote
+            if posix and quote in escapedquotes:
+                stop += escape
+            self.quoted_run[quote] = re.compile('[^%s]+' % _char_class(stop))
+
+
+_lexer_spec = lru_cache(maxsize=32)(_LexerSpec)
+
 
 class shlex:
     "A lexical analyzer class for simple shell-like syntaxes."
-    def __init__(self, instream=None, infile=None, posix=False):
+    def __init__(self, instream=None, infile=None, posix=False,
+                 block_size=None):
         if isinstance(instream, str):
             instream = StringIO(instream)
         if instream is not None:
@@ -32,11 +128,10 @@ class shlex:
         else:
             self.eof = ''
         self.commenters = '#'
-        self.wordchars = ('abcdfeghijklmnopqrstuvwxyz'
-                          'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
         if self.posix:
-            self.wordchars += ('ßàáâãäåæçèéêëìíîïðñòóôõöøùúûüýþÿ'
-                               'ÀÁÂÃÄÅÆÇÈÉÊËÌÍÎÏÐÑÒÓÔÕÖØÙÚÛÜÝÞ')
+            self.wordchars = _POSIX_WORDCHARS
+        else:
+            self.wordchars = _WORDCHARS
         self.whitespace = ' \t\r\n'
         self.whitespace_split = False
         self.quotes = '\'"'
@@ -49,6 +144,11 @@ class shlex:
         self.token = ''
         self.filestack = deque()
         self.source = None
+        # read the input block_size characters at a time, if set
+        self.block_size = block_size
+        self._buffer = ''
+        self._pos = 0
+        self._bufferstack = deque()
 
     def push_token(self, tok):
         "Push a token onto the stack popped by the get_token method"
@@ -61,6 +161,9 @@ class shlex:
         if isinstance(newstream, str):
             newstream = StringIO(newstream)
         self.filestack.appendleft((self.infile, self.instream, self.lineno))
+        self._bufferstack.appendleft((self._buffer, self._pos))
+        self._buffer = ''
+        self._pos = 0
         self.infile = newfile
         self.instream = newstream
         self.lineno = 1
@@ -74,6 +177,7 @@ class shlex:
         "Pop the input source stack."
         self.instream.close()
         (self.infile, self.instream, self.lineno) = self.filestack.popleft()
+        (self._buffer, self._pos) = self._bufferstack.popleft()
         if self.debug:
             print('shlex: popping to %s, line %d' \
                   % (self.instream, self.lineno))
@@ -112,6 +216,8 @@ class shlex:
         return raw
 
     def read_token(self):
+        if self.block_size:
+            return self._read_token_blocks()
         quoted = False
         escapedstate = ' '
         while True:
@@ -239,6 +345,196 @@ class shlex:
                 print("shlex: raw token=EOF")
         return result
 
+    def _config(self):
+        return (self.wordchars, self.whitespace, self.commenters,
+                self.quotes, self.escape, self.escapedquotes,
+                self.whitespace_split, self.posix)
+
+    def _spec(self):
+        # the _LexerSpec of the current configuration
+        return _lexer_spec(*self._config())
+
+    def _read_token_blocks(self):
+        # read_token() over a buffer filled block_size characters at a time;
+        # runs of whitespace, word and quoted characters are consumed with
+        # one regexp match each, and the token is joined once at the end
+        spec = self._spec()
+        buf = self._buffer
+        pos = self._pos
+        state = self.state
+        if state == ' ' and spec.plain_token:
+            match = spec.plain_token(buf, pos)
+            if match:
+                token = [match[1]]
+                end = match.end()
+                self.lineno += buf.count('\n', pos, end)
+                self._pos = end
+                return self._emit_token(token, False)
+        posix = self.posix
+        quotes = self.quotes
+        lineno = self.lineno
+        escapedstate = ' '
+        quoted = False
+        token = []
+        while True:
+            if pos >= len(buf):
+                buf = self.instream.read(self.block_size)
+                pos = 0
+            nextchar = buf[pos] if buf else ''
+            if state is None:
+                token = []             # past end of file
+                break
+            elif state == ' ':
+                if not nextchar:
+                    state = None       # end of file
+                    break
+                cls = spec.blank.get(nextchar, spec.default)
+                if cls == _WHITESPACE:
+                    if self.debug >= 2:
+                        print("shlex: I see whitespace in whitespace state")
+                    if not (token or (posix and quoted)):
+                        end = spec.whitespace_run.match(buf, pos).end()
+                        lineno += buf.count('\n', pos, end)
+                        pos = end
+                        continue
+                pos += 1
+                lineno += nextchar == '\n'
+                if cls == _WHITESPACE:
+                    break   # emit current token
+                elif cls == _COMMENT:
+                    buf, pos = self._skip_line(buf, pos)
+                    lineno += 1
+                elif cls == _ESCAPE:
+                    escapedstate = 'a'
+                    state = nextchar
+                elif cls == _WORD:
+                    token = [nextchar]
+                    state = 'a'
+                elif cls == _QUOTE:
+                    if not posix:
+                        token = [nextchar]
+                    state = nextchar
+                else:
+                    token = [nextchar]
+                    break   # emit current token
+            elif state in quotes:
+                quoted = True
+                if not nextchar:      # end of file
+                    if self.debug >= 2:
+                        print("shlex: I see EOF in quotes state")
+                    self._save_blocks(buf, pos, lineno, state, token)
+                    # XXX what error should be raised here?
+                    raise ValueError("No closing quotation")
+                if nextchar == state:
+                    pos += 1
+                    lineno += nextchar == '\n'
+                    if not posix:
+                        token.append(nextchar)
+                        state = ' '
+                        break
+                    else:
+                        state = 'a'
+                elif posix and nextchar in self.escape and \
+                     state in self.escapedquotes:
+                    pos += 1
+                    lineno += nextchar == '\n'
+                    escapedstate = state
+                    state = nextchar
+                else:
+                    end = spec.quoted_run[state].match(buf, pos).end()
+                    token.append(buf[pos:end])
+                    lineno += buf.count('\n', pos, end)
+                    pos = end
+            elif state in self.escape:
+                if not nextchar:      # end of file
+                    if self.debug >= 2:
+                        print("shlex: I see EOF in escape state")
+                    self._save_blocks(buf, pos, lineno, state, token)
+                    # XXX what error should be raised here?
+                    raise ValueError("No escaped character")
+                pos += 1
+                lineno += nextchar == '\n'
+                # In posix shells, only the quote itself or the escape
+                # character may be escaped within quotes.
+                if escapedstate in quotes and \
+                   nextchar != state and nextchar != escapedstate:
+                    token.append(state)
+                token.append(nextchar)
+                state = escapedstate
+            elif state == 'a':
+                if not nextchar:
+                    state = None    # end of file
+                    break
+                cls = spec.word.get(nextchar, spec.default)
+                if cls == _WORD:
+                    end = spec.word_run.match(buf, pos).end()
+                    token.append(buf[pos:end])
+                    lineno += buf.count('\n', pos, end)
+                    pos = end
+                    continue
+                pos += 1
+                lineno += nextchar == '\n'
+                if cls == _WHITESPACE:
+                    if self.debug >= 2:
+                        print("shlex: I see whitespace in word state")
+                    state = ' '
+                    if token or (posix and quoted):
+                        break   # emit current token
+                elif cls == _COMMENT:
+                    buf, pos = self._skip_line(buf, pos)
+                    lineno += 1
+                    if posix:
+                        state = ' '
+                        if token or (posix and quoted):
+                            break   # emit current token
+                elif cls == _QUOTE:
+                    state = nextchar
+                elif cls == _ESCAPE:
+                    escapedstate = 'a'
+                    state = nextchar
+                else:
+                    self.pushback.appendleft(nextchar)
+                    if self.debug >= 2:
+                        print("shlex: I see punctuation in word state")
+                    state = ' '
+                    if token:
+                        break   # emit current token
+            else:
+                # read_token() reads and drops characters in other states
+                pos += 1
+                lineno += nextchar == '\n'
+        self._save_blocks(buf, pos, lineno, state, [])
+        return self._emit_token(token, quoted)
+
+    def _emit_token(self, token, quoted):
+        result = ''.join(token)
+        if self.posix and not quoted and result == '':
+            result = None
+        if self.debug > 1:
+            if result:
+                print("shlex: raw token=" + repr(result))
+            else:
+                print("shlex: raw token=EOF")
+        return result
+
+    def _skip_line(self, buf, pos):
+        # what instream.readline() would skip, across blocks
+        while True:
+            end = buf.find('\n', pos)
+            if end >= 0:
+                return buf, end + 1
+            buf = self.instream.read(self.block_size)
+            pos = 0
+            if not buf:
+                return buf, pos
+
+    def _save_blocks(self, buf, pos, lineno, state, token):
+        self._buffer = buf
+        self._pos = pos
+        self.lineno = lineno
+        self.state = state
+        self.token = ''.join(token)
+
     def sourcehook(self, newfile):
         "Hook called on a filename to be sourced."
         if newfile[0] == '"':
@@ -256,6 +552,113 @@ class shlex:
             lineno = self.lineno
         return "\"%s\", line %d: " % (infile, lineno)
 
+    def parallel_tokens(self, workers=None, chunk_size=1 << 20):
+        """Yield (token, lineno) for the rest of the input, in parallel.
+
+        The pairs are those iterating over the lexer gives, lineno being
+        read after each token.  The input is cut after a newline about
+        every chunk_size characters and the pieces are tokenized by a pool
+        of worker processes (workers of them, os.cpu_count() by default).
+        A cut is only kept once the piece before it is shown to end
+        between tokens, with no open quote, pending escape or word carried
+        on by a comment; otherwise the two pieces are tokenized again as
+        one, and once a token runs on over several pieces the rest of the
+        input is tokenized in this process instead.  A lexer with a source
+        keyword, pushed sources or debugging on is iterated as usual, as
+        inclusions read other files.
+        """
+        if self.source is not None or self.filestack or self.debug or \
+           self.state != ' ':
+            for token in self:
+                yield token, self.lineno
+            return
+        while self.pushback:
+            yield self.pushback.popleft(), self.lineno
+
+        # the pool is only needed here, so plain lexing never loads it
+        from concurrent.futures import ProcessPoolExecutor
+
+        config = self._config()
+        # enough queued pieces that no worker waits for the next, few
+        # enough that finished ones don't wait long to be merged
+        limit = 2 * (workers or os.cpu_count() or 1)
+        pieces = self._line_chunks(chunk_size)
+        pending = deque()
+        carry = []
+
+        def emit(tokens, lines):
+            base = self.lineno - 1
+            for token, lineno in tokens:
+                self.lineno = base + lineno
+                yield token, self.lineno
+            self.lineno = base + lines
+
+        with ProcessPoolExecutor(workers) as pool:
+            def in_order():
+                for piece in pieces:
+                    pending.append((piece, pool.submit(_chunk_tokens, config,
+                                                       piece)))
+                    if len(pending) >= limit:
+                        yield pending.popleft()
+                while pending:
+                    yield pending.popleft()
+
+            for piece, future in in_order():
+                result = future.result()
+                if carry:
+                    # the piece doesn't start where the last one ended
+                    carry.append(piece)
+                    if len(carry) > _CARRY_PIECES:
+                        break
+                    result = _chunk_tokens(config, ''.join(carry))
+                tokens, clean, lines, error = result
+                if not clean:
+                    carry = carry or [piece]
+                    continue
+                carry = []
+                yield from emit(tokens, lines)
+            else:
+                self.state = None
+                if carry:
+                    # the end of the input, which needn't end between tokens
+                    yield from emit(tokens, lines)
+                    if error:
+                        raise ValueError(error)
+                return
+            for piece, future in pending:
+                future.cancel()
+
+        # a token running on over several pieces: rather than tokenizing
+        # ever longer carries again, the rest is read here in one pass
+        rest = chain(carry, (piece for piece, future in pending), pieces)
+        lex = _chunk_lexer(config, _PieceStream(rest), chunk_size)
+        base = self.lineno - 1
+        self.state = None
+        try:
+            for token in lex:
+                self.lineno = base + lex.lineno
+                yield token, self.lineno
+        finally:
+            self.lineno = base + lex.lineno
+
+    def _line_chunks(self, chunk_size):
+        # the rest of the input in pieces of about chunk_size characters,
+        # all but the last ending with a newline
+        rest = self._buffer[self._pos:]
+        self._buffer = ''
+        self._pos = 0
+        while True:
+            data = self.instream.read(chunk_size)
+            if not data:
+                break
+            rest += data
+            cut = rest.rfind('\n') + 1
+            if cut:
+                yield rest[:cut]
+                rest = rest[cut:]
+        if rest:
+            yield rest
+
     def __iter__(self):
         return self
 
@@ -265,12 +668,189 @@ class shlex:
             raise StopIteration
         return token
 
-def split(s, comments=False, posix=True):
-    lex = shlex(s, posix=posix)
+# how many pieces parallel_tokens() tokenizes again as one before it
+# reads the rest of the input itself
+_CARRY_PIECES = 4
+
+
+class _PieceStream:
+    # a stream of an iterable of strings, for a lexer in block mode: each
+    # read returns the next string, whatever size was asked for
+    def __init__(self, pieces):
+        self._pieces = iter(pieces)
+
+    def read(self, size=-1):
+        return next(self._pieces, '')
+
+
+def _chunk_lexer(config, instream, block_size):
+    lex = shlex(instream, posix=config[-1], block_size=block_size)
+    (lex.wordchars, lex.whitespace, lex.commenters, lex.quotes, lex.escape,
+     lex.escapedquotes, lex.whitespace_split, lex.posix) = config
+    return lex
+
+
+def _chunk_tokens(config, text):
+    # Runs in a worker process.  Returns the (token, lineno) pairs of text,
+    # whether it ends between tokens, the lineno at its end and the error
+    # message, if any.
+    lex = _chunk_lexer(config, text, len(text))
+    tokens = []
+    clean = True
+    try:
+        for token in lex:
+            tokens.append((token, lex.lineno))
+            # a word or quote still open at the end leaves state None
+            clean = lex.state == ' '
+    except ValueError as e:
+        return tokens, False, lex.lineno, str(e)
+    return tokens, clean, lex.lineno, None
+
+
+def _split_lexer(s, comments, posix, block_size=None):
+    lex = shlex(s, posix=posix, block_size=block_size)
     lex.whitespace_split = True
     if not comments:
         lex.commenters = ''
-    return list(lex)
+    return lex
+
+
+@lru_cache(maxsize=None)
+def _split_spec(comments, posix):
+    return _split_lexer('', comments, posix)._spec()
+
+
+def _scan(s, spec):
+    # Yields (start, end, segments) for each token of s, as a shlex with
+    # whitespace_split would read them; segments is None when s[start:end]
+    # is the token itself, else the pieces of the token.
+    posix = spec.posix
+    quotes = spec.quotes
+    escape = spec.escape
+    escapedquotes = spec.escapedquotes
+    blank = spec.blank
+    word = spec.word
+    default = spec.default
+    whitespace_run = spec.whitespace_run
+    word_run = spec.word_run
+    n = len(s)
+    pos = 0
+    while True:
+        if whitespace_run is not None:
+            match = whitespace_run.match(s, pos)
+            if match:
+                pos = match.end()
+        if pos >= n:
+            return
+        nextchar = s[pos]
+        cls = blank.get(nextchar, default)
+        if cls == _COMMENT:
+            pos = s.find('\n', pos + 1) + 1 or n
+            continue
+        start = pos
+        pos += 1
+        if cls == _WORD:
+            match = word_run.match(s, pos)
+            if match:
+                pos = match.end()
+            if pos >= n or word.get(s[pos], default) == _WHITESPACE:
+                yield start, pos, None
+                continue
+            state = 'a'
+            token = [s[start:pos]]
+        elif cls == _ESCAPE:
+            escapedstate = 'a'
+            state = nextchar
+            token = []
+        else:
+            state = nextchar
+            token = [] if posix else [nextchar]
+        # the token isn't a plain word: as read_token() in the states
+        # other than ' ', which only returns to at the end of the token
+        while True:
+            nextchar = s[pos] if pos < n else ''
+            if state == 'a':
+                if not nextchar:
+                    end = pos
+                    break
+                cls = word.get(nextchar, default)
+                if cls == _WORD:
+                    end = word_run.match(s, pos).end()
+                    token.append(s[pos:end])
+                    pos = end
+                elif cls == _WHITESPACE:
+                    end = pos
+                    break
+                elif cls == _COMMENT:
+                    end = pos
+                    pos = s.find('\n', pos + 1) + 1 or n
+                    if posix:
+                        break
+                    # without posix the word goes on on the next line
+                elif cls == _QUOTE:
+                    state = nextchar
+                    pos += 1
+                else:
+                    escapedstate = 'a'
+                    state = nextchar
+                    pos += 1
+            elif state in quotes:
+                if not nextchar:
+                    raise ValueError("No closing quotation")
+                if nextchar == state:
+                    pos += 1
+                    if not posix:
+                        token.append(nextchar)
+                        end = pos
+                        break
+                    state = 'a'
+                elif posix and nextchar in escape and state in escapedquotes:
+                    escapedstate = state
+                    state = nextchar
+                    pos += 1
+                else:
+                    end = spec.quoted_run[state].match(s, pos).end()
+                    token.append(s[pos:end])
+                    pos = end
+            else:
+                if not nextchar:
+                    raise ValueError("No escaped character")
+                # In posix shells, only the quote itself or the escape
+                # character may be escaped within quotes.
+                if escapedstate in quotes and \
+                   nextchar != state and nextchar != escapedstate:
+                    token.append(state)
+                token.append(nextchar)
+                state = escapedstate
+                pos += 1
+        yield start, end, token
+
+
+def iter_spans(s, comments=False, posix=True):
+    """Yield a (start, end, kind) tuple for each token split() finds in s.
+
+    s[start:end] is the token's text in s, quotes and escapes included.
+    kind is 'word' when that text is the token itself, so it can be used
+    without copying, and 'quoted' when split() removes quotes or escape
+    characters from it.
+    """
+    for start, end, segments in _scan(s, _split_spec(comments, posix)):
+        if segments is None or ''.join(segments) == s[start:end]:
+            yield start, end, 'word'
+        else:
+            yield start, end, 'quoted'
+
+
+def split(s, comments=False, posix=True):
+    if not isinstance(s, str):
+        return list(_split_lexer(s, comments, posix))
+    spec = _split_spec(comments, posix)
+    if not spec.find_special(s):
+        # no quotes, escapes or comments: just the words
+        return spec.word_run.findall(s)
+    # each token is a slice of s or joined once from its pieces
+    return [s[start:end] if segments is None else ''.join(segments)
+            for start, end, segments in _scan(s, spec)]
 
 
 _find_unsafe = re.compile(r'[^\w@%+=:,./-]', re.ASCII).search
@@ -287,6 +867,22 @@ def quote(s):
     return "'" + s.replace("'", "'\"'\"'") + "'"
 
 
+def quote_many(args):
+    """Return a list of the shell-escaped versions of the strings in args.
+
+    Strings that need no quoting are returned as they are.
+    """
+    find_unsafe = _find_unsafe
+    # as quote(), whose "''" for the empty string is the general case too
+    return [s if s and find_unsafe(s) is None
+            else "'" + s.replace("'", "'\"'\"'") + "'" for s in args]
+
+
+def join(args):
+    """Return a shell-escaped command line from the strings in args."""
+    return ' '.join(quote_many(args))
+
+
 def _print_tokens(lexer):
     while 1:
         tt = lexer.get_token()
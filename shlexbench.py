@@ -0,0 +1,150 @@
+"""
+shlexbench.py - micro-benchmarks for the shlex module
+
+Run as a script:  python shlexbench.py [name ...]
+"""
+
+import os
+import random
+import sys
+import time
+
+import shlex
+
+__all__ = ["timeit", "make_script", "bench_read_token", "bench_split",
+           "bench_spans", "bench_quote", "bench_parallel_tokens"]
+
+
+def timeit(func, *args, repeat=3):
+    """Return the best wall-clock time of func(*args) over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_script(lines, seed=0):
+    """Return a generated command file of the given number of lines."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(lines):
+        words = ["run", "--job=job%d" % i, "--input",
+                 '"/data/in put %d.txt"' % rnd.randint(0, 10**6),
+                 "--label", "'%s'" % " ".join(
+                     rnd.choice(["alpha", "beta", "x\\y", "it's"])
+                     for _ in range(rnd.randint(1, 4))).replace("'", ""),
+                 "value\\ with\\ spaces"]
+        if rnd.random() < 0.2:
+            words.append("# trailing comment")
+        out.append(" ".join(words))
+    return "\n".join(out) + "\n"
+
+
+def bench_read_token(lines=(100, 10000), block_size=1 << 16):
+    """Tokenize a command file one character and one block at a time."""
+    scripts = [("%6d lines" % count, make_script(count)) for count in lines]
+    # a few very long quoted arguments
+    scripts.append(("long args", 'cat "%s"\n' % ("x " * 20000) * 10))
+    for name, script in scripts:
+        for posix in (False, True):
+            def run(size):
+                lex = shlex.shlex(script, posix=posix, block_size=size)
+                lex.whitespace_split = True
+                for _ in lex:
+                    pass
+            old = timeit(run, None)
+            new = timeit(run, block_size)
+            print("read_token %s posix=%-5s: chars %.4fs "
+                  "(%.2f MB/s)  blocks %.4fs (%.2f MB/s)  x%.1f"
+                  % (name, posix, old, len(script) / old / 1e6, new,
+                     len(script) / new / 1e6, old / new))
+
+
+def _split_chars(s, comments=False, posix=True):
+    # the original split(), kept as the reference point
+    lex = shlex.shlex(s, posix=posix)
+    lex.whitespace_split = True
+    if not comments:
+        lex.commenters = ''
+    return list(lex)
+
+
+def bench_split(short=100000, long=10):
+    """Split many short command lines and a few long ones."""
+    lines = make_script(short // 10).splitlines()
+    cases = [
+        ("%d short plain" % short, ["ls -l /tmp/dir%d --x=%d" % (i, i)
+                                    for i in range(short)]),
+        ("%d short quoted" % short, (lines * 10)[:short]),
+        ("%d long" % long, [" ".join(lines[:1000])] * long),
+    ]
+    for name, strings in cases:
+        old = timeit(lambda: [_split_chars(s) for s in strings])
+        new = timeit(lambda: [shlex.split(s) for s in strings])
+        print("split %-20s: lexer %.4fs  split %.4fs  x%.1f"
+              % (name, old, new, old / new))
+
+
+def bench_spans(lengths=(1 << 10, 1 << 14, 1 << 18)):
+    """Locate tokens of quoted arguments of growing length."""
+    for length in lengths:
+        s = 'cmd "%s" \'%s\' %s' % ("a b\\\"" * (length // 6),
+                                     "x y" * (length // 3),
+                                     "w\\ " * (length // 3))
+        old = timeit(_split_chars, s, repeat=1)
+        new = timeit(shlex.split, s)
+        spans = timeit(lambda: list(shlex.iter_spans(s)))
+        print("spans %7d chars: lexer %.4fs  split %.4fs  iter_spans %.4fs"
+              % (len(s), old, new, spans))
+
+
+def bench_quote(count=200000):
+    """Join command lines of safe and of unsafe arguments."""
+    cases = [
+        ("safe", ["--job=%d" % i for i in range(count)]),
+        ("unsafe", ["it's %d" % i for i in range(count)]),
+        ("mixed", ["--job=%d" % i if i % 2 else "a b %d" % i
+                   for i in range(count)]),
+    ]
+    for name, args in cases:
+        old = timeit(lambda: ' '.join(shlex.quote(arg) for arg in args))
+        new = timeit(shlex.join, args)
+        print("quote %d %-6s args: quote %.4fs  join %.4fs  x%.1f"
+              % (count, name, old, new, old / new))
+
+
+def bench_parallel_tokens(lines=50000, chunk_size=1 << 18):
+    """Tokenize a command file serially and with 1..cpu_count() workers."""
+    script = make_script(lines)
+    def serial():
+        lex = shlex.shlex(script, posix=True)
+        lex.whitespace_split = True
+        for _ in lex:
+            pass
+    print("parallel_tokens %d lines: serial %.3fs"
+          % (lines, timeit(serial, repeat=1)))
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        def parallel():
+            lex = shlex.shlex(script, posix=True)
+            lex.whitespace_split = True
+            for _ in lex.parallel_tokens(workers, chunk_size):
+                pass
+        print("parallel_tokens %d lines: %2d workers %.3fs"
+              % (lines, workers, timeit(parallel, repeat=1)))
+        workers *= 2
+
+
+def main(argv):
+    names = argv or [name[6:] for name in __all__
+                     if name.startswith("bench_")]
+    for name in names:
+        globals()["bench_" + name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,316 @@
+import asyncio
+import io
+import mmap
+import os
+import random
+import re
+import tempfile
+from array import array
+
+import pytest
+
+import csv
+
+
+@pytest.fixture
+def write_file():
+    paths = []
+
+    def write(text):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='',
+                                         delete=False) as f:
+            f.write(text)
+        paths.append(f.name)
+        return f.name
+
+    yield write
+    for path in paths:
+        os.unlink(path)
+
+
+class skipspace(csv.excel):
+    skipinitialspace = True
+
+
+class escaped(csv.excel):
+    escapechar = '\\'
+    doublequote = False
+
+
+class escaped_doublequote(csv.excel):
+    escapechar = '\\'
+
+
+@pytest.mark.parametrize("text, dialect", [
+    # a quote inside an unquoted field doesn't open a quoted one
+    ('a"b,"x\ny"\n' * 4, csv.excel),
+    ('a, "x\ny",b"c\n' * 4, skipspace),
+    ('a\\"b,"x\\"\ny",c\\\nd\n' * 4, escaped),
+    ('"a ""quoted"" one","x\n\ny"\n' * 4, csv.excel),
+    # an escapechar right after a closing quote is taken as it is
+    ('a,"x"\\\\\nb,"c\nd"\n' * 4, escaped_doublequote),
+    ('"x"\\"y\nz",1\n' * 4, escaped_doublequote),
+])
+@pytest.mark.parametrize("chunk_size", [1, 4, 7, 64])
+def test_parallel_reader_matches_reader(write_file, text, dialect,
+                                        chunk_size):
+    path = write_file(text)
+    with open(path, newline='') as f:
+        expected = list(csv.reader(f, dialect))
+    assert list(csv.parallel_reader(path, dialect, 1, chunk_size)) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "a,b\n1,2\n3\n",
+    "a,b\n" + "1,2\n" * 30 + "3\n",
+])
+def test_read_batch_typed_short_rows(text):
+    batch = csv.DictReader(io.StringIO(text)).read_batch(100, typed=True)
+    assert batch["a"] == array('q', [1] * (len(batch["a"]) - 1) + [3])
+    assert batch["b"][-1] is None
+    assert isinstance(batch["b"], list)
+
+
+def test_sniffer_subclass_without_init():
+    class S(csv.Sniffer):
+        def __init__(self):
+            self.preferred = [';']
+
+    assert S().sniff("a;b;c\n1;2;3\n4;5;6\n").delimiter == ';'
+
+
+@pytest.mark.parametrize("row", [{"a": 1}, {"a": 1, "b": 2}])
+def test_dictwriter_fieldnames_from_keys(row):
+    out = io.StringIO()
+    w = csv.DictWriter(out, row.keys())
+    w.writeheader()
+    w.writerow(row)
+    assert list(csv.reader(io.StringIO(out.getvalue()))) == [
+        list(row), [str(v) for v in row.values()]]
+
+
+def test_sniff_consensus_outvotes_preamble_of_small_file(write_file):
+    path = write_file("".join("key%d;value;x\n" % i for i in range(40)) +
+                      "".join("%d,b%d,c,%d\n" % (i, i, i * 7)
+                              for i in range(1000)))
+    dialect, confidence = csv.Sniffer().sniff_consensus(path, regions=5)
+    assert dialect.delimiter == ','
+    assert confidence == 0.8
+
+
+def test_sniff_consensus_merges_split_votes(write_file):
+    # every region finds ',' and ';' equally consistent, so each shares
+    # its vote between them and the preferred one wins
+    path = write_file("a,b;c\n" * 100)
+    dialect, confidence = csv.Sniffer().sniff_consensus(path, regions=4)
+    assert dialect.delimiter == ','
+    assert confidence == 0.5
+
+
+def test_sniff_many_reports_failures(write_file):
+    good = write_file("a,b,c\n1,2,3\n4,5,6\n")
+    missing = good + ".missing"
+    with pytest.raises(FileNotFoundError):
+        list(csv.sniff_many([good, missing], workers=1))
+
+    errors = []
+    results = list(csv.sniff_many([good, missing], workers=1,
+                                  onerror=lambda *args: errors.append(args)))
+    assert [(path, dialect.delimiter, header)
+            for path, dialect, header in results] == [(good, ',', True)]
+    assert [path for path, _ in errors] == [missing]
+
+
+@pytest.mark.parametrize("buffer_size", [1, 50, 1 << 16])
+def test_dictwriter_buffered_matches_unbuffered(buffer_size):
+    fieldnames = ["a", "b", "c"]
+    rows = [{"a": str(i), "b": "x,y" if i % 3 else "", "c": i}
+            for i in range(100)]
+    expected = io.StringIO()
+    w = csv.DictWriter(expected, fieldnames)
+    w.writeheader()
+    w.writerows(rows)
+
+    out = io.StringIO()
+    with csv.DictWriter(out, fieldnames, buffer_size=buffer_size) as w:
+        w.writeheader()
+        w.writerows(rows[:50])
+        for row in rows[50:]:
+            w.writerow(row)
+    assert out.getvalue() == expected.getvalue()
+
+
+RAGGED = "a,b,c\n1,2,3\n4,5\n6,7,8,9,10\n"
+
+
+@pytest.mark.parametrize("usecols", [None, ["a", "c"]])
+def test_namedtuple_records_match_dicts(usecols):
+    dicts = list(csv.DictReader(io.StringIO(RAGGED), restkey="rest",
+                                restval="-", usecols=usecols))
+    records = list(csv.DictReader(io.StringIO(RAGGED), restkey="rest",
+                                  restval="-", usecols=usecols,
+                                  record="namedtuple"))
+    for d, record in zip(dicts, records):
+        assert {k: v for k, v in record._asdict().items()
+                if v is not None} == d
+    assert len(records) == len(dicts) == 3
+
+
+@pytest.mark.parametrize("usecols", [None, ["a", "c"]])
+def test_namedtuple_long_row_without_restkey(usecols):
+    rows = csv.DictReader(io.StringIO(RAGGED), usecols=usecols,
+                          record="namedtuple")
+    assert next(rows) == ("1", "2", "3")[::2 if usecols else 1]
+    assert next(rows)[-1] is None
+    with pytest.raises(csv.Error, match="line 4"):
+        next(rows)
+
+
+@pytest.mark.parametrize("where", [None, {"a": "1"}])
+def test_dictreader_line_num_after_blank_rows(where):
+    rows = csv.DictReader(io.StringIO("a,b\n\n\n1,2\n\n3,4\n"), where=where)
+    next(rows)
+    assert rows.line_num == rows.reader.line_num == 4
+
+
+ASYNC_TEXT = ('name,note,n\r\n'
+              'a,"quoted\nnewline, and ""quotes""",1\r\n'
+              '\r\n'
+              'é,plain,2\n'
+              'b,"x\r\n\r\ny",3,extra\n'
+              'short\n')
+
+
+async def read_async(chunks, block_size):
+    stream = asyncio.StreamReader()
+    for chunk in chunks:
+        stream.feed_data(chunk)
+    stream.feed_eof()
+    rows = csv.AsyncDictReader(stream, restkey="rest",
+                               block_size=block_size)
+    return [(row, rows.line_num) async for row in rows]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_async_dictreader_matches_dictreader(seed):
+    rnd = random.Random(seed)
+    rows = csv.DictReader(io.StringIO(ASYNC_TEXT, newline=''),
+                          restkey="rest")
+    expected = [(row, rows.line_num) for row in rows]
+    # cut anywhere, even inside a quoted field or an encoded character
+    data = ASYNC_TEXT.encode('utf-8')
+    cuts = sorted(rnd.sample(range(1, len(data)), rnd.randint(0, 10)))
+    chunks = [data[i:j] for i, j in zip([0] + cuts, cuts + [len(data)])]
+    block_size = rnd.choice([1, 2, 5, 1 << 16])
+    assert asyncio.run(read_async(chunks, block_size)) == expected
+
+
+class DrainedStream:
+    # a StreamWriter stand-in recording what is written between drains
+    def __init__(self):
+        self.data = b''
+        self.drained = []
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        await asyncio.sleep(0)
+        self.drained.append(len(self.data))
+
+
+@pytest.mark.parametrize("buffer_size", [1, 20, 1 << 16])
+def test_async_dictwriter_matches_dictwriter(buffer_size):
+    fieldnames = ["name", "note"]
+    rows = [{"name": "é%d" % i, "note": "a,b\n" if i % 2 else "c"}
+            for i in range(10)]
+    expected = io.StringIO()
+    w = csv.DictWriter(expected, fieldnames)
+    w.writeheader()
+    w.writerows(rows)
+
+    async def write():
+        stream = DrainedStream()
+        w = csv.AsyncDictWriter(stream, fieldnames, buffer_size=buffer_size)
+        await w.writeheader()
+        await w.writerows(rows)
+        await w.flush()
+        return stream
+
+    stream = asyncio.run(write())
+    assert stream.data.decode('utf-8') == expected.getvalue()
+    # every block is drained as it is written
+    assert stream.drained[-1] == len(stream.data)
+    if buffer_size == 1:
+        assert len(stream.drained) == len(rows) + 1
+
+
+QUOTE_PATTERNS = [re.compile(restr, re.DOTALL | re.MULTILINE) for restr in (
+    r'(?P<delim>[^\w\n"\'])(?P<space> ?)(?P<quote>["\']).*?(?P=quote)(?P=delim)',
+    r'(?:^|\n)(?P<quote>["\']).*?(?P=quote)(?P<delim>[^\w\n"\'])(?P<space> ?)',
+    r'(?P<delim>>[^\w\n"\'])(?P<space> ?)(?P<quote>["\']).*?(?P=quote)(?:$|\n)',
+    r'(?:^|\n)(?P<quote>["\']).*?(?P=quote)(?:$|\n)')]
+
+
+def quoted_regexp(data):
+    # the original findall() of each pattern in turn, kept as the reference
+    # point for csv._quoted_scan()
+    for regexp in QUOTE_PATTERNS:
+        matches = regexp.findall(data)
+        if matches:
+            break
+    else:
+        return []
+    groupindex = regexp.groupindex
+    if 'delim' not in groupindex:
+        return [(m, None, None) for m in matches]
+    return [(m[groupindex['quote'] - 1], m[groupindex['delim'] - 1],
+             m[groupindex['space'] - 1]) for m in matches]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_quoted_scan_matches_regexps(seed):
+    rnd = random.Random(seed)
+    alphabet = 'a1_ ,;>\t\n"\'é'
+    for _ in range(5000):
+        data = ''.join(rnd.choice(alphabet)
+                       for _ in range(rnd.randint(0, 30)))
+        assert csv._quoted_scan(data) == quoted_regexp(data), data
+
+
+def test_sniff_many_uses_delimiters(write_file):
+    # has_header() reads the sample with the dialect found, rather than
+    # sniffing it again without the delimiters
+    path = write_file("hh,i;j\n1,x;2\n3,y;4\n")
+    [(_, dialect, header)] = csv.sniff_many([path], workers=1,
+                                            delimiters=';')
+    assert dialect.delimiter == ';'
+    assert header
+
+
+@pytest.mark.parametrize("sample, expected", [
+    ("name,n,x\na,1,1.5\nb,2,2\nc,3,x\n", (True, [str, int, None])),
+    ("1,2\n3,4.5\n5,6\n", (False, [int, None])),
+    ("a,b\nc,d\n", (False, [str, str])),
+])
+def test_header_and_types(sample, expected):
+    sniffer = csv.Sniffer()
+    assert sniffer.header_and_types(sample, csv.excel) == expected
+    assert sniffer.has_header(sample, csv.excel) == expected[0]
+    assert sniffer.column_types(sample, csv.excel) == expected[1]
+
+
+def test_quote_windows_end_on_lines(write_file):
+    # lines of about 1 KB, so the 64 KB window of each region falls
+    # inside one
+    line = "%s,'%s'\n" % ("a" * 600, "b" * 500)
+    path = write_file(line * 1000)
+    with open(path, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+         memoryview(mm) as view:
+        regions = csv._sample_regions(mm, 1 << 20)
+        windows = list(csv._quote_windows(mm, view, regions, 'utf-8'))
+    assert len(windows) == 3
+    for window in windows:
+        assert 0 < len(window) <= csv._QUOTE_WINDOW
+        assert window == line * (len(window) // len(line))
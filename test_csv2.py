@@ -0,0 +1,70 @@
+import pickle
+import random
+
+import pytest
+
+import csv2
+
+
+class StepwiseSniffer(csv2.Sniffer):
+    # the original descent through the consistency levels, 0.01 at a time
+    def _update_delims(self, delims, total, modes, delimiters):
+        consistency = 1.0
+        threshold = 0.9
+        while len(delims) == 0 and consistency >= threshold:
+            for char, (per_line, lines_count) in modes.items():
+                if per_line > 0 and lines_count > 0:
+                    consistency_is_ok = (lines_count / total) >= consistency
+                    char_is_allowed = delimiters is None or char in delimiters
+                    if consistency_is_ok and char_is_allowed:
+                        delims[char] = per_line, lines_count
+            consistency -= 0.01
+
+
+def random_modes(rnd, chars, total):
+    # line counts around the consistency levels, where rounding matters
+    modes = {}
+    for char in rnd.sample(chars, rnd.randint(0, 20)):
+        lines_count = rnd.choice([
+            total, total - 1, total - 2, rnd.randint(-total, total),
+            int(total * 0.9), int(total * 0.95),
+            int(total * rnd.uniform(0.85, 1))])
+        modes[char] = rnd.choice([0, 1, 2, rnd.randint(0, 9)]), lines_count
+    return modes
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_update_delims_matches_stepwise(seed):
+    rnd = random.Random(seed)
+    chars = [chr(c) for c in range(127)]
+    direct, stepwise = csv2.Sniffer(), StepwiseSniffer()
+    for _ in range(5000):
+        total = rnd.choice([10, 20, 30, 50, 100, rnd.randint(1, 1000)])
+        modes = random_modes(rnd, chars, total)
+        delimiters = rnd.choice([None, ',;\t', ''.join(rnd.sample(chars, 5))])
+        start = {} if rnd.random() < 0.9 else {'x': (1, 1)}
+        got, expected = dict(start), dict(start)
+        direct._update_delims(got, total, modes, delimiters)
+        stepwise._update_delims(expected, total, modes, delimiters)
+        # the order matters too, as ties go to the first delimiter found
+        assert list(got.items()) == list(expected.items()), \
+            (total, modes, delimiters)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_delimiter_stats_pickle_and_resume(seed):
+    rnd = random.Random(seed)
+    lines = [''.join(rnd.choice('ab,;\t "') for _ in range(rnd.randint(0, 12)))
+             for _ in range(60)]
+    whole = csv2.DelimiterStats()
+    for i in range(0, len(lines), 10):
+        whole.update(lines[i:i + 10])
+
+    k = rnd.randint(1, len(lines) - 1)
+    first = csv2.DelimiterStats()
+    first.update(lines[:k])
+    resumed = pickle.loads(pickle.dumps(first))
+    resumed.update(lines[k:])
+    assert resumed.lines == whole.lines == len(lines)
+    assert resumed.modes == whole.modes
+    assert resumed.char_frequency == whole.char_frequency
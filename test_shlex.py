@@ -0,0 +1,190 @@
+import io
+import random
+
+import pytest
+
+import shlex
+
+
+ALPHABET = 'ab c\n\n\t"\'\\#;é(x  '
+
+
+def random_text(rnd, length=60):
+    return ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, length)))
+
+
+def make_lexer(text, config, block_size=None):
+    posix, whitespace_split, commenters = config
+    lex = shlex.shlex(io.StringIO(text), posix=posix, block_size=block_size)
+    lex.whitespace_split = whitespace_split
+    lex.commenters = commenters
+    return lex
+
+
+def read_all(lex, step=None):
+    # (token, lineno) pairs until eof, then the error if any and where the
+    # lexer ended; step(lex, tokens) may push tokens or sources in between
+    tokens = []
+    try:
+        while True:
+            if step is not None:
+                step(lex, tokens)
+            token = lex.get_token()
+            if token == lex.eof:
+                break
+            tokens.append((token, lex.lineno))
+    except ValueError as e:
+        tokens.append(('error', str(e)))
+    return tokens, lex.lineno, lex.state
+
+
+CONFIGS = [(posix, split, commenters) for posix in (False, True)
+           for split in (False, True) for commenters in ('#', '')]
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_blocks_match_chars(config):
+    rnd = random.Random(repr(config))
+    for _ in range(1000):
+        text = random_text(rnd)
+        expected = read_all(make_lexer(text, config))
+        for block_size in (1, 3, 64):
+            assert read_all(make_lexer(text, config, block_size)) == \
+                expected, (text, block_size)
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_blocks_match_chars_with_pushback_and_sources(config):
+    rnd = random.Random(repr(config))
+    for _ in range(300):
+        text = random_text(rnd)
+        pushed = random_text(rnd, 20)
+        # the same steps, drawn once, for both lexers
+        actions = [rnd.choice([None, None, None, 'token', 'source'])
+                   for _ in range(len(text) + 1)]
+
+        def step(lex, tokens):
+            action = actions[len(tokens)] if len(tokens) < len(actions) \
+                     else None
+            if action == 'token':
+                lex.push_token('pushed')
+            elif action == 'source' and not lex.filestack:
+                lex.push_source(pushed)
+
+        expected = read_all(make_lexer(text, config), step)
+        for block_size in (1, 5):
+            assert read_all(make_lexer(text, config, block_size), step) == \
+                expected, (text, pushed, actions, block_size)
+
+
+class _SourceLexer(shlex.shlex):
+    # reads the file named after "source" from a dict
+    files = {'inc': 'x "y z"\nw\n', 'empty': ''}
+
+    def sourcehook(self, newfile):
+        return newfile, io.StringIO(self.files.get(newfile, 'missing'))
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 64])
+def test_blocks_match_chars_with_source_keyword(block_size):
+    text = 'a source inc b\nsource empty c "source" inc\nsource inc'
+
+    def read(block_size):
+        lex = _SourceLexer(text, posix=True, block_size=block_size)
+        lex.source = 'source'
+        return read_all(lex)
+
+    expected = read(None)
+    assert ('y z', 2) in expected[0]
+    assert read(block_size) == expected
+
+
+def split_chars(s, comments, posix):
+    # the original split(): a lexer reading one character at a time
+    lex = shlex.shlex(s, posix=posix)
+    lex.whitespace_split = True
+    if not comments:
+        lex.commenters = ''
+    return list(lex)
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except ValueError as e:
+        return 'error', str(e)
+
+
+@pytest.mark.parametrize("comments", [False, True])
+@pytest.mark.parametrize("posix", [False, True])
+def test_split_matches_lexer(comments, posix):
+    rnd = random.Random(repr((comments, posix)))
+    for _ in range(3000):
+        s = random_text(rnd, 40)
+        assert outcome(shlex.split, s, comments, posix) == \
+            outcome(split_chars, s, comments, posix), s
+
+
+@pytest.mark.parametrize("comments", [False, True])
+@pytest.mark.parametrize("posix", [False, True])
+def test_iter_spans_match_split(comments, posix):
+    rnd = random.Random(repr((comments, posix)))
+    for _ in range(3000):
+        s = random_text(rnd, 40)
+        tokens = outcome(shlex.split, s, comments, posix)
+        spans = outcome(lambda: list(shlex.iter_spans(s, comments, posix)))
+        if isinstance(tokens, tuple):
+            assert spans == tokens, s
+            continue
+        assert len(spans) == len(tokens), s
+        last = 0
+        for (start, end, kind), token in zip(spans, tokens):
+            assert last <= start <= end, s
+            last = end
+            # each span holds its token, which it re-splits to
+            assert shlex.split(s[start:end], comments, posix) == [token], s
+            assert kind == ('word' if s[start:end] == token else 'quoted'), s
+
+
+def parallel_read(lex, chunk_size):
+    tokens = []
+    try:
+        tokens.extend(lex.parallel_tokens(workers=1, chunk_size=chunk_size))
+    except ValueError as e:
+        tokens.append(('error', str(e)))
+    return tokens, lex.lineno
+
+
+def sequential_read(lex):
+    tokens = []
+    try:
+        for token in lex:
+            tokens.append((token, lex.lineno))
+    except ValueError as e:
+        tokens.append(('error', str(e)))
+    return tokens, lex.lineno
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_parallel_tokens_match_iteration(config):
+    rnd = random.Random(repr(config))
+    for _ in range(3):
+        # mostly short lines, which a piece seldom ends inside a token of
+        text = '\n'.join(random_text(rnd, 12) for _ in range(200))
+        expected = sequential_read(make_lexer(text, config))
+        for chunk_size in (1, 40):
+            assert parallel_read(make_lexer(text, config), chunk_size) == \
+                expected, (text, chunk_size)
+
+
+@pytest.mark.parametrize("text", [
+    # a quote left open on the first line is carried past _CARRY_PIECES
+    # pieces, and the rest is read in the calling process
+    'a "open\n' + 'b c\n' * 100,
+    'a "closed\n' + 'b c\n' * 100 + 'd" e\n' + 'f g\n' * 20,
+])
+def test_parallel_tokens_after_long_carry(text):
+    config = (True, False, '#')
+    assert text.count('\n') > 2 * shlex._CARRY_PIECES
+    expected = sequential_read(make_lexer(text, config))
+    assert parallel_read(make_lexer(text, config), 8) == expected